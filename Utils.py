@@ -1,5 +1,26 @@
+from __future__ import annotations
+from typing import overload
 import sys
+import os
 
 def pypy_notice() -> None:
     if not sys.implementation.name.startswith('pypy'):
-        print('\n*****\nUsing pypy is recommended for performance.\n*****\n')
\ No newline at end of file
+        print('\n*****\nUsing pypy is recommended for performance.\n*****\n')
+
+@overload
+def flag_value(flag: str) -> str | None: ...
+@overload
+def flag_value(flag: str, default: str) -> str: ...
+def flag_value(flag: str, default: str | None = None) -> str | None:
+    """Returns the command line argument after `flag`, or `default` if `flag` wasn't passed."""
+    return sys.argv[sys.argv.index(flag) + 1] if flag in sys.argv else default
+
+def write_atomically(filepath: str, text: str) -> None:
+    """Writes `text` to a temp file and then renames it to `filepath`, so that a kill during the write
+       leaves either the old contents or the new ones, never a mix."""
+    temp_path = f"{filepath}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, filepath)
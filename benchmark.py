@@ -0,0 +1,192 @@
+"""Benchmarks for the evaluators, the simulation loops and versus.py, in operations per second: hand
+evaluations for the evaluators, trials for `run_sims`, and boards for versus.py. Only the standard
+library is needed (the numpy engine is benchmarked too, if NumPy is installed), so this runs under
+both CPython and PyPy.
+
+Usage: `python benchmark.py [--quick] [--only <substring>] [--output <file>] [--baseline <file>]
+[--tolerance <fraction>]`
+
+The results are written as JSON (by default, to `benchmarks/<implementation> <time>.json`). Pass one
+of these files as `--baseline` to flag each benchmark that's slower than it by more than the
+tolerance (by default 0.1, i.e. 10%); the exit code is then 1 if there are any regressions."""
+
+from __future__ import annotations
+from itertools import chain, count, islice
+from time import perf_counter, time
+from types import ModuleType
+from typing import Callable, Iterator, Optional
+import json
+import os
+import platform
+import random
+import sys
+
+import compare
+from compare import GameType, num_card_vals, num_hole_cards
+import evaluator
+from main import EV, HandType2Cards, HandType4Cards, run_sims
+import Utils
+
+BENCHMARK_SECONDS = 1.0
+"""How long each benchmark runs for, per repeat."""
+REPEATS = 3
+"""Each benchmark's result is its best rate over this many repeats."""
+NUM_DEALS = 1000
+
+Benchmark = Callable[[int], None]
+"""Does the given number of operations."""
+
+def measure(benchmark: Benchmark, batch: int, seconds: float, repeats: int) -> float:
+    """Returns the best rate (in operations per second) over `repeats` runs of `benchmark`, each of
+       which calls it with `batch` operations at a time until `seconds` have passed."""
+    benchmark(batch) # warms up caches (and PyPy's JIT)
+    best = 0.0
+    for _ in range(repeats):
+        ops, start = 0, perf_counter()
+        while (elapsed := perf_counter() - start) < seconds:
+            benchmark(batch)
+            ops += batch
+        best = max(best, ops / elapsed)
+    return best
+
+def _deals(num_cards: int) -> list[list[int]]:
+    rng = random.Random(0)
+    deck = range(4 * (len(evaluator.VALS) - num_card_vals()), 52)
+    return [rng.sample(deck, num_cards) for _ in range(NUM_DEALS)]
+
+def _cycle(items: list) -> Iterator:
+    while True:
+        yield from items
+
+def _legacy_five_card(deals: Iterator[list[int]]) -> Benchmark:
+    def benchmark(n: int) -> None:
+        for cards in islice(deals, n):
+            vals = sorted(card >> 2 for card in cards)
+            compare.getHandRankFromFiveCards(vals, len({card & 3 for card in cards}) == 1)
+    return benchmark
+
+def _legacy_best_comb(deals: Iterator[list[int]]) -> Benchmark:
+    h = num_hole_cards()
+    def benchmark(n: int) -> None:
+        for cards in islice(deals, n):
+            compare.getBestComb(tuple(c >> 2 for c in cards[:h]), tuple(c & 3 for c in cards[:h]),
+                                tuple(c >> 2 for c in cards[h:]), tuple(c & 3 for c in cards[h:]))
+    return benchmark
+
+def _evaluate5(deals: Iterator[list[int]]) -> Benchmark:
+    evaluate5 = compare.evaluator().evaluate5
+    def benchmark(n: int) -> None:
+        for cards in islice(deals, n):
+            evaluate5(*cards)
+    return benchmark
+
+def _best_hand(deals: Iterator[list[int]]) -> Benchmark:
+    ev_, h = compare.evaluator(), num_hole_cards()
+    def benchmark(n: int) -> None:
+        for cards in islice(deals, n):
+            ev_.best_hand(cards[:h], ev_.prepare_board(cards[h:]))
+    return benchmark
+
+def _run_sims(simulate: Callable, num_opps: int) -> Benchmark:
+    hand_type = (HandType4Cards(('A', 'A', 'K', 'K')) if compare.gametype() == GameType.OMAHA else
+                 HandType2Cards('A', 'K', True))
+    def benchmark(n: int) -> None:
+        simulate(hand_type, num_opps, num_opps, seed=0, max_trials=n)
+    return benchmark
+
+def _versus_boards() -> Benchmark:
+    """Goes through the boards as versus.py's loop does: each board is dealt by `canonical_boards`,
+       completed, evaluated for both hands, and written out (to os.devnull)."""
+    import versus
+    hands_str = "AsAhKsKh QdQcJdJc"
+    hands = [evaluator.encode_cards(hand_str) for hand_str in hands_str.split()]
+    rem_cards = [c for c in range(51, -1, -1) if c not in hands[0] + hands[1]]
+    symmetries = versus.suit_symmetries(hands[0] + hands[1])
+    boards = chain.from_iterable(versus.canonical_boards(rem_cards, symmetries) for _ in count())
+    ev_, ev = compare.evaluator(), EV()
+    partial_board = ev_.prepare_partial_board(())
+    writer = versus.ResultsWriter(os.devnull, versus.ResultsHeader(hands_str))
+    def benchmark(n: int) -> None:
+        for runout, weight in islice(boards, n):
+            board_info = ev_.complete_board(partial_board, runout)
+            strengths = [ev_.best_hand(hand, board_info) for hand in hands]
+            best = max(strengths)
+            winners = [player for player, strength in enumerate(strengths) if strength == best]
+            result = None if len(winners) == 2 else winners == [0]
+            writer.write(runout, weight, result)
+            ev.add_result(versus.num_winners(result), weight)
+            versus.result_line(hands_str, ''.join(evaluator.decode_card(x) for x in runout), weight, result)
+    return benchmark
+
+def _on_deals(make: Callable[[Iterator[list[int]]], Benchmark], num_cards: int) -> Callable[[], Benchmark]:
+    return lambda: make(_cycle(_deals(num_cards)))
+
+def _sims(simulate: Callable, num_opps: int) -> Callable[[], Benchmark]:
+    return lambda: _run_sims(simulate, num_opps)
+
+def benchmarks() -> Iterator[tuple[str, GameType, Callable[[], Benchmark], int]]:
+    """Yields the name, gametype, setup function and batch size of each benchmark."""
+    vectorized: Optional[ModuleType]
+    try:
+        import vectorized
+    except ImportError:
+        vectorized = None
+    for gametype in GameType:
+        name = gametype.name.lower()
+        h = 4 if gametype == GameType.OMAHA else 2
+        yield f"{name} getHandRankFromFiveCards", gametype, _on_deals(_legacy_five_card, 5), 1000
+        yield f"{name} getBestComb", gametype, _on_deals(_legacy_best_comb, h + 5), 100
+        yield f"{name} evaluate5", gametype, _on_deals(_evaluate5, 5), 1000
+        yield f"{name} best_hand", gametype, _on_deals(_best_hand, h + 5), 1000
+        for num_opps in (1, 5, 9):
+            yield f"{name} run_sims vs {num_opps} opps", gametype, _sims(run_sims, num_opps), 200
+            if vectorized is not None:
+                yield (f"{name} numpy run_sims vs {num_opps} opps", gametype,
+                       _sims(vectorized.run_sims, num_opps), 10000)
+    yield "omaha versus.py boards", GameType.OMAHA, _versus_boards, 1000
+
+def run(only: str | None, seconds: float, repeats: int) -> dict[str, float]:
+    results: dict[str, float] = {}
+    for name, gametype, setup, batch in benchmarks():
+        if only and only not in name:
+            continue
+        compare.set_gametype(gametype)
+        results[name] = round(measure(setup(), batch, seconds, repeats), 1)
+        print(f"{name}: {results[name]:,} per second")
+    return results
+
+def regressions(results: dict[str, float], baseline: dict[str, float], tolerance: float,
+                only: str | None = None) -> list[str]:
+    """Returns the names of the benchmarks that are slower than `baseline` by more than `tolerance`,
+       or that have no result (of those in `baseline` that `only` selects)."""
+    return [name for name, rate in baseline.items() if (not only or only in name) and
+            (name not in results or results[name] < rate * (1 - tolerance))]
+
+def main() -> None:
+    quick = '--quick' in sys.argv
+    only = Utils.flag_value('--only')
+    results = run(only, 0.2 if quick else BENCHMARK_SECONDS, 1 if quick else REPEATS)
+    output = Utils.flag_value(
+        '--output', f"benchmarks/{sys.implementation.name} {round(time())}.json"
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    Utils.write_atomically(output, json.dumps({
+        'implementation': sys.implementation.name, 'python_version': platform.python_version(),
+        'machine': platform.machine(), 'time': round(time()), 'results': results
+    }, indent=2))
+    print(f"\nWrote {output}")
+    if (baseline_path := Utils.flag_value('--baseline')) is None:
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    tolerance = float(Utils.flag_value('--tolerance', '0.1'))
+    for name, rate in results.items():
+        if name in baseline:
+            print(f"{name}: {round((rate / baseline[name] - 1) * 100, 1):+}% vs the baseline")
+    if slower := regressions(results, baseline, tolerance, only):
+        print(f"\nRegressions (more than {tolerance:.0%} slower than {baseline_path}, or no result):")
+        print('\n'.join(name + ('' if name in results else ' (no result)') for name in slower))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
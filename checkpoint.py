@@ -0,0 +1,64 @@
+"""Checkpoints of a `main.py` sweep, so that a killed run can continue with `--resume`.
+
+Each hand type gets its own small JSON file in the sweep's folder, holding the state of its `EV` for
+each number of opps (see `EV.state`) and whether its simulation finished. Workers only ever write the
+file for the hand type they're simulating, and every write is atomic."""
+
+from __future__ import annotations
+import json
+import os
+from typing import Optional
+
+import Utils
+
+class Checkpoints:
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, f"{name}.json")
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.folder)
+
+    def load(self, name: str) -> Optional[dict]:
+        if not os.path.exists(self._path(name)):
+            return None
+        with open(self._path(name), 'r') as f:
+            return json.load(f)
+
+    def save(self, name: str, data: dict) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        Utils.write_atomically(self._path(name), json.dumps(data))
+
+    def has(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def save_if_missing(self, name: str, data: dict) -> dict:
+        """Saves `data` unless the `name` checkpoint exists, and returns what the checkpoint holds. Of
+           slices of a sweep that start at the same time, only the first one's save is kept."""
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = f"{self._path(name)}.{os.getpid()}.tmp"
+        Utils.write_atomically(temp_path, json.dumps(data))
+        try:
+            os.link(temp_path, self._path(name)) # fails if the checkpoint exists
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+        loaded = self.load(name)
+        assert loaded is not None
+        return loaded
+
+    def remove(self, name: str) -> None:
+        if os.path.exists(self._path(name)):
+            os.remove(self._path(name))
+
+    def remove_folder_if_unused(self, meta_name: str) -> None:
+        """Removes the folder if nothing but the `meta_name` checkpoint is left in it (other slices of
+           the same sweep may still be using it)."""
+        filenames = os.listdir(self.folder)
+        if [name for name in filenames if not name.endswith('.tmp')] == [f"{meta_name}.json"]:
+            for name in filenames:
+                os.remove(os.path.join(self.folder, name)) # including temp files left by a kill
+            os.rmdir(self.folder)
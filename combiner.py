@@ -1,34 +1,55 @@
+"""Combines the results files in a folder (e.g. the quarter slices of a sweep, or several runs of it)
+into one `combined.txt` file, ranking each hand type among the others with the same number of opps.
+Lines for the same hand type and number of opps are merged into one, pooling their trials."""
+
+from __future__ import annotations
+from functools import reduce
 import sys
 import os
 
-def sort_key(line: str) -> str:
-    return ' '.join(sub for sub in line.split() if not sub.endswith(('%', ':')))
+from main import EV
+from results_store import ResultsLine, parse_results_line
 
-def percentage_val(line: str) -> float:
-    return next(float(word[:-1]) for word in line.split() if word.endswith('%'))
+def merge(lines: list[ResultsLine]) -> ResultsLine:
+    """Pools the trials of `lines` (all for the same hand type and number of opps). Lines without
+       the number of hands can't be weighted, so if any are among them, the equities are averaged."""
+    if len(lines) == 1:
+        return lines[0]
+    if any(line.ev is None for line in lines):
+        return ResultsLine(lines[0].hand_type, lines[0].num_opps,
+                           round(sum(line.equity for line in lines) / len(lines), 3), None)
+    evs = [line.ev for line in lines if line.ev is not None]
+    total = reduce(EV.merge, evs)
+    return ResultsLine(lines[0].hand_type, lines[0].num_opps, total.ev(), total)
 
-def assign_rank(lines: list[str], line: str) -> int:
-    assert all(l.endswith(' opps') for l in lines)
-    similar_lines = [l for l in lines if l.split()[-2] == line.split()[-2]]
-    similar_lines.sort(key=lambda l: percentage_val(l), reverse=True)
-    return similar_lines.index(line) + 1
+def line_text(line: ResultsLine) -> str:
+    text = str(line.ev) if line.ev else f"{line.hand_type} wins {line.equity}% of the pot on avg"
+    return f"{text} vs {line.num_opps} opps"
 
 def main() -> None:
     folder_name = sys.argv[1]
-    lines: list[str] = []
     output_filename = 'combined.txt'
+    grouped: dict[tuple[str, int], list[ResultsLine]] = {}
     for file in os.listdir(os.fsencode(folder_name)):
         filename = os.fsdecode(file)
         if filename == output_filename:
             raise FileExistsError(f"Already a `{output_filename}` file in the {folder_name} folder")
         with open(f"{folder_name}/{filename}", 'r') as f:
-            lines.extend(line.rstrip() for line in f)
-    lines.sort(key=sort_key)
-    lines = [' '.join(line.split()[1:]) for line in lines]
-    lines = [f"#{assign_rank(lines, line)}: {line}" for line in lines]
+            for text in f:
+                if text.strip():
+                    line = parse_results_line(text)
+                    grouped.setdefault((line.hand_type, line.num_opps), []).append(line)
+    merged = {key: merge(lines) for key, lines in grouped.items()}
+    by_opps: dict[int, list[tuple[str, int]]] = {}
+    for key in merged:
+        by_opps.setdefault(key[1], []).append(key)
+    ranks: dict[tuple[str, int], int] = {}
+    for group in by_opps.values():
+        group.sort(key=lambda key: merged[key].equity, reverse=True)
+        ranks.update((key, i+1) for i, key in enumerate(group))
     with open(f"{folder_name}/{output_filename}", 'w') as f:
-        for line in lines:
-            f.write(line + '\n')
+        for key in sorted(merged):
+            f.write(f"#{ranks[key]}: {line_text(merged[key])}\n")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
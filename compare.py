@@ -4,52 +4,88 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import Optional
+from functools import cache
+from typing import Optional, Sequence
 import itertools
 
+from evaluator import VALS, Evaluator, encode_cards
+
 class GameType(Enum):
     TEXAS = 'texas holdem'
     SHORTDECK = 'regular shortdeck'
     SHORTDECK_TRIPS = 'shortdeck trips variant',
     OMAHA = 'original omaha'
 
-_ranks = {}
-_num_card_vals: Optional[int] = None
-_mapping = str.maketrans("TJQKA", ":;<=>")
-_gametype: Optional[GameType] = None
+class GameRules:
+    """Everything about a gametype that the evaluation depends on, computed once: the ranks of the
+       categories that vary between gametypes, the card vals in the deck, and the evaluator (with its
+       tables). The functions below that take an optional `rules` use the gametype chosen by
+       `set_gametype` when it's None, so passing rules explicitly lets one process mix gametypes."""
+    def __init__(self, gametype: GameType):
+        self.gametype = gametype
+        self.ranks = {'boat': 6, 'flush': 5, 'straight': 4, 'trips': 3}
+        self.num_card_vals = 13
+        if gametype in (GameType.SHORTDECK, GameType.SHORTDECK_TRIPS):
+            self.num_card_vals = 9
+            self.ranks['boat'], self.ranks['flush'] = self.ranks['flush'], self.ranks['boat']
+            if gametype == GameType.SHORTDECK_TRIPS:
+                self.ranks['straight'], self.ranks['trips'] = self.ranks['trips'], self.ranks['straight']
+        self.omaha = gametype == GameType.OMAHA
+        self.num_hole_cards = 4 if self.omaha else 2
+        self.card_vals = VALS[len(VALS) - self.num_card_vals:]
+        """In increasing order."""
+        self.deck = tuple(range(4 * (len(VALS) - self.num_card_vals), 52))
+        """Every int-encoded card (see evaluator.py) in the deck, in increasing order."""
+        self.evaluator = Evaluator(self.ranks, self.num_card_vals, self.omaha)
+
+    def __reduce__(self):
+        # Pickled (e.g. to send to a worker process) as just the gametype, not the tables:
+        return rules_for, (self.gametype,)
+
+@cache
+def rules_for(gametype: GameType) -> GameRules:
+    """The `GameRules` of `gametype`, built the first time they're needed and shared after that."""
+    return GameRules(gametype)
+
+_rules: Optional[GameRules] = None
 
 def set_gametype(chosen_gametype: GameType):
-    global _ranks, _num_card_vals, _gametype
-    _gametype = chosen_gametype
-    _ranks['boat'], _ranks['flush'], _ranks['straight'], _ranks['trips'] = 6, 5, 4, 3
-    _num_card_vals = 13
-    if chosen_gametype in (GameType.SHORTDECK, GameType.SHORTDECK_TRIPS):
-        _num_card_vals = 9
-        _ranks['boat'], _ranks['flush'] = _ranks['flush'], _ranks['boat']
-        if chosen_gametype == GameType.SHORTDECK_TRIPS:
-            _ranks['straight'], _ranks['trips'] = _ranks['trips'], _ranks['straight']
+    """Chooses the gametype that the functions here (and elsewhere) use when they aren't given
+       `rules`."""
+    global _rules
+    _rules = rules_for(chosen_gametype)
+
+def game_rules(rules: Optional[GameRules] = None) -> GameRules:
+    """Returns `rules` if given, or else the rules of the gametype chosen by `set_gametype`."""
+    if rules is not None:
+        return rules
+    assert _rules
+    return _rules
 
 def rank(hand_type: str) -> int:
-    return _ranks[hand_type]
+    return game_rules().ranks[hand_type]
 
 def num_card_vals() -> int:
-    assert _num_card_vals is not None
-    return _num_card_vals
+    return game_rules().num_card_vals
 
 def gametype() -> GameType:
-    assert _gametype
-    return _gametype
+    return game_rules().gametype
+
+def evaluator() -> Evaluator:
+    return game_rules().evaluator
 
 def num_hole_cards() -> int:
-    return 4 if gametype() == GameType.OMAHA else 2
+    return game_rules().num_hole_cards
 
 # todo - make a global function (accessible to other files) for the list of CARDS being used,
 # and maybe make this and the other appropriate funcs in this file part of a common new file.
 
 rank_counters_h1 = [0] * 9
 rank_counters_h2 = [0] * 9
-def first5HandIsBetter(h1: list[int], h2: list[int], debug: bool = False) -> bool | None:
+def first5HandIsBetter(h1: list[int], h2: list[int], debug: bool = False,
+                       rules: Optional[GameRules] = None) -> bool | None:
     """Given info on two hands (the 5 cards + rank + relevant kicker details), say which wins"""
+    ranks = game_rules(rules).ranks
     if debug:
         rank_counters_h1[h1[5]] += 1
         rank_counters_h2[h2[5]] += 1
@@ -58,58 +94,62 @@ def first5HandIsBetter(h1: list[int], h2: list[int], debug: bool = False) -> boo
             print(rank_counters_h2)
     if h1[5] != h2[5]:
         return h1[5] > h2[5] # different ranks
-    if h1[5] in (rank('straight'), 8):
+    if h1[5] in (ranks['straight'], 8):
         # SF or straight: check middle card, and if needed check if an ace is actually the low card
         return h1[2] > h2[2] if h1[2] != h2[2] else h1[4] < h2[4] if h1[4] != h2[4] else None
-    if h1[5] in (0, rank('flush')): # flush or high card: check all five cards
+    if h1[5] in (0, ranks['flush']): # flush or high card: check all five cards
         return next((h1[i] > h2[i] for i in (4,3,2,1,0) if h1[i] != h2[i]), None)
     # The hands must both be one of quads, trips, boat, two pair, or one pair:
     assert 8 <= len(h1) == len(h2) <= 10
     return next((h1[i] > h2[i] for i in range(6, len(h1)) if h1[i] != h2[i]), None)
 
 def getBestComb(playerVals: tuple[int, ...], playerSuits: tuple[int, ...],
-                commVals: tuple[int, ...], commSuits: tuple[int, ...]) -> list[int]:
+                commVals: tuple[int, ...], commSuits: tuple[int, ...],
+                rules: Optional[GameRules] = None) -> list[int]:
     """Given 7 cards (or 4+5 for Omaha), call the 5-card comparator on each of the possible combos."""
+    rules = game_rules(rules)
     player_cards = sorted(zip(playerVals, playerSuits, strict=True), key=lambda t: t[0])
     comm_cards = sorted(zip(commVals, commSuits, strict=True), key=lambda t: t[0])
-    assert len(commVals) == len(commSuits) == 5 and len(playerVals) == len(playerSuits) == num_hole_cards()
+    assert len(commVals) == len(commSuits) == 5 and len(playerVals) == len(playerSuits) == rules.num_hole_cards
     bestHandRank = None
-    for num_comm_cards in range(3, (4 if gametype() == GameType.OMAHA else 6)):
+    for num_comm_cards in range(3, (4 if rules.omaha else 6)):
         for comm_comb, player_comb in itertools.product(
             itertools.combinations(comm_cards, num_comm_cards),
             itertools.combinations(player_cards, 5 - num_comm_cards)
         ):
             comb = tuple(sorted(comm_comb + player_comb, key=lambda t: t[0]))
             newHandRank = getHandRankFromFiveCards(
-                [t[0] for t in comb], all(comb[0][1] == t[1] for t in comb)
+                [t[0] for t in comb], all(comb[0][1] == t[1] for t in comb), rules
             )
-            if not bestHandRank or first5HandIsBetter(newHandRank, bestHandRank):
+            if not bestHandRank or first5HandIsBetter(newHandRank, bestHandRank, rules=rules):
                 bestHandRank = newHandRank
     assert bestHandRank
     return bestHandRank
 
-def getHandRankFromFiveCards(fC: list[int], all_same_suit: bool):
+def getHandRankFromFiveCards(fC: list[int], all_same_suit: bool, rules: Optional[GameRules] = None):
     """`fC` contains the five values (should already be sorted) and `fS` contains the five suits."""
+    rules = game_rules(rules)
+    ranks, num_card_vals = rules.ranks, rules.num_card_vals
     # given 5 cards, determine what the rank of the hand is and add kicker info to it
     if all_same_suit:
         # flush, see if it's a regular flush or a straight flush
         fC.append(8 if (    all(fC[0] == fC[i] - i for i in (1,2,3))
-                        and (fC[4] - 1 == fC[3] or fC[4] - (num_card_vals()-1) == fC[0]))
-                    else rank('flush'))
+                        and (fC[4] - 1 == fC[3] or fC[4] - (num_card_vals-1) == fC[0]))
+                    else ranks['flush'])
     elif (all(fC[0] == fC[i] - i for i in (1,2,3)) and
-          (fC[4] - 1 == fC[3] or fC[4] - (num_card_vals()-1) == fC[0])):
-        fC.append(rank('straight'))  # straight
+          (fC[4] - 1 == fC[3] or fC[4] - (num_card_vals-1) == fC[0])):
+        fC.append(ranks['straight'])  # straight
     elif fC[1] == fC[3] in (fC[0], fC[4]):
         fC.extend((7, fC[0], fC[4]) if fC[0] == fC[1] else (7, fC[4], fC[0])) # quads
     elif fC[0] == fC[2] and fC[3] == fC[4]:
-        fC.extend((rank('boat'), fC[0], fC[4]))  # boat, high set full of low pair
+        fC.extend((ranks['boat'], fC[0], fC[4]))  # boat, high set full of low pair
     elif fC[0] == fC[1] and fC[2] == fC[4]:
-        fC.extend((rank('boat'), fC[4], fC[0]))  # boat, low set full of high pair
+        fC.extend((ranks['boat'], fC[4], fC[0]))  # boat, low set full of high pair
     elif fC[0] == fC[2]:
-        fC.extend((rank('trips'), fC[0], fC[4], fC[3]))
+        fC.extend((ranks['trips'], fC[0], fC[4], fC[3]))
         # trips, both kickers higher; other kicker-types of trips in next line
     elif fC[2] == fC[3] in (fC[1], fC[4]):
-        fC.append(rank('trips'))
+        fC.append(ranks['trips'])
         fC.extend((fC[1], fC[4], fC[0]) if fC[1] == fC[2] else (fC[2], fC[1], fC[0]))
     elif ((fC[0] == fC[1] and fC[3] in (fC[2], fC[4])) or
           (fC[1] == fC[2] and fC[3] == fC[4])):  # two pair
@@ -138,11 +178,27 @@ def add_spacing(cards: str) -> str:
         groups[x] = new_str
     return '\n'.join(groups)
 
-def is_first_hand_better(cards: str) -> bool | None:
+def strengths(hands: Sequence[Sequence[int]], comm: Sequence[int],
+              rules: Optional[GameRules] = None) -> list[int]:
+    """`hands` holds each player's int-encoded hole cards (see evaluator.py), and `comm` the 5 community
+       cards. Each hand is evaluated once, and its strength returned (a greater int is a better hand)."""
+    rules = game_rules(rules)
+    assert len(comm) == 5 and all(len(hand) == rules.num_hole_cards for hand in hands)
+    board_info = rules.evaluator.prepare_board(comm)
+    best_hand = rules.evaluator.best_hand
+    return [best_hand(hand, board_info) for hand in hands]
+
+def winners(hands: Sequence[Sequence[int]], comm: Sequence[int],
+            rules: Optional[GameRules] = None) -> list[int]:
+    """Takes the same args as `strengths`, and returns the indices of the hands that win (or split)
+       the pot, in increasing order."""
+    hand_strengths = strengths(hands, comm, rules)
+    best = max(hand_strengths)
+    return [i for i, strength in enumerate(hand_strengths) if strength == best]
+
+def is_first_hand_better(cards: str, rules: Optional[GameRules] = None) -> bool | None:
     """`cards` should be in a format like this: `KhQh AsJs 5c6dTh4dJd`; for Omaha, the format is similar
         but with 4 cards, 4 cards, 5 cards."""
-    groups = tuple(tuple(ord(card) for card in section.translate(_mapping)) for section in cards.split())
-    assert len(groups) == 3 and all(len(group) % 2 == 0 for group in groups)
-    comm_vals, comm_suits = groups[2][::2], groups[2][1::2]
-    return first5HandIsBetter(getBestComb(groups[0][::2], groups[0][1::2], comm_vals, comm_suits),
-                              getBestComb(groups[1][::2], groups[1][1::2], comm_vals, comm_suits))
+    hand1, hand2, comm = (encode_cards(section) for section in cards.split())
+    result = winners((hand1, hand2), comm, rules)
+    return None if len(result) == 2 else result == [0]
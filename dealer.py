@@ -0,0 +1,127 @@
+"""Deals int-encoded cards (see evaluator.py) from one reusable deck, for the simulation loops."""
+
+from __future__ import annotations
+from bisect import bisect
+from itertools import accumulate, combinations
+from typing import Iterable, Optional, Sequence
+import random
+
+from evaluator import BIT
+
+class Dealer:
+    def __init__(self, cards: Iterable[int], rng: random.Random):
+        """`cards` are the cards in the deck, and `rng` is the (seeded) stream to deal them with."""
+        self.deck = list(cards)
+        self._position = [-1] * 52
+        """The index of each card in `deck`."""
+        for i, card in enumerate(self.deck):
+            self._position[card] = i
+        self._random = rng.random
+
+    def deal(self, excluded: Iterable[int], num_cards: int) -> list[int]:
+        """Shuffles the deck in place, just enough that its first `num_cards` cards are a uniformly
+           random draw from the cards not in `excluded`, and returns it. No lists or sets are
+           created: the returned deck is the same list each time (so it's only valid until the next
+           deal), and only `num_cards` steps of a Fisher-Yates shuffle are done."""
+        deck, position, random_ = self.deck, self._position, self._random
+        end = len(deck)
+        for card in excluded: # moved to the end, out of reach of the shuffle
+            end -= 1
+            i, other = position[card], deck[end]
+            deck[i], deck[end] = other, card
+            position[other], position[card] = i, end
+        for i in range(num_cards):
+            j = i + int(random_() * (end - i))
+            card, other = deck[i], deck[j]
+            deck[i], deck[j] = other, card
+            position[other], position[card] = i, j
+        return deck
+
+BOARD_STRATA = ('unpaired, at most 2 of a suit', 'paired, at most 2 of a suit',
+                'unpaired, 3+ of a suit', 'paired, 3+ of a suit')
+"""The board textures that stratified dealing is done over, indexed by `board_texture`."""
+_GOLDEN = (5 ** 0.5 - 1) / 2
+
+def board_texture(cards: Sequence[int]) -> int:
+    """The index in `BOARD_STRATA` of the 5 card board that's the first 5 `cards`."""
+    a, b, c, d, e = cards[0], cards[1], cards[2], cards[3], cards[4]
+    paired = bin(BIT[a] | BIT[b] | BIT[c] | BIT[d] | BIT[e]).count('1') < 5
+    suit_counts = (1 << 4*(a & 3)) + (1 << 4*(b & 3)) + (1 << 4*(c & 3)) + (1 << 4*(d & 3)) + (1 << 4*(e & 3))
+    return 2 * any(suit_counts >> 4*suit & 15 >= 3 for suit in range(4)) + paired
+
+def texture_probabilities(cards: Iterable[int]) -> list[float]:
+    """The probability of each of the `BOARD_STRATA` for a 5 card board dealt from `cards`, counted
+       exactly (val by val, by the number of cards, distinct vals and cards of each suit so far)."""
+    suits_by_val: dict[int, list[int]] = {}
+    for card in cards:
+        suits_by_val.setdefault(card >> 2, []).append(card & 3)
+    counts: dict[tuple[int, int, tuple[int, ...]], int] = {(0, 0, (0, 0, 0, 0)): 1}
+    for suits in suits_by_val.values():
+        new_counts: dict[tuple[int, int, tuple[int, ...]], int] = {}
+        for (num_cards, num_vals, suit_counts), ways in counts.items():
+            for k in range(min(len(suits), 5 - num_cards) + 1):
+                for chosen in combinations(suits, k):
+                    new_suit_counts = list(suit_counts)
+                    for suit in chosen:
+                        new_suit_counts[suit] += 1
+                    key = (num_cards + k, num_vals + (k > 0), tuple(new_suit_counts))
+                    new_counts[key] = new_counts.get(key, 0) + ways
+        counts = new_counts
+    strata = [0] * len(BOARD_STRATA)
+    for (num_cards, num_vals, suit_counts), ways in counts.items():
+        if num_cards == 5:
+            strata[2 * (max(suit_counts) >= 3) + (num_vals < 5)] += ways
+    return [ways / sum(strata) for ways in strata]
+
+class ScenarioDealer:
+    """Deals scenarios (the opps' cards and the rest of the board) that don't depend on the hero's
+       hand, for common random numbers: with the same seed, every hand type faces the same scenarios
+       (as long as it uses the same number of random numbers per trial). A scenario is dealt from the
+       whole deck along with some spare cards, and the cards that collide with the hero's hand are
+       dropped, the later cards moving up to take their places (so the cards dealt are still a
+       uniformly random draw from the rest of the deck).
+
+       If `stratified`, the 5 card boards are sampled by `BOARD_STRATA`, in the exact proportions of
+       the deck's `texture_probabilities` (trial `i` is given a stratum from a Weyl sequence, and
+       boards are dealt until one has that texture)."""
+    def __init__(self, cards: Iterable[int], rng: random.Random, num_opp_cards: int, num_board_cards: int,
+                 num_hero_cards: int, stratified: bool = False):
+        cards = list(cards)
+        self._dealer = Dealer(cards, rng)
+        self.num_opp_cards, self.num_board_cards, self.num_hero_cards = num_opp_cards, num_board_cards, num_hero_cards
+        self.cards = [0] * (num_opp_cards + num_board_cards)
+        """The latest scenario: the opps' cards, followed by the rest of the board."""
+        self._cumulative: Optional[list[float]] = None
+        if stratified:
+            assert num_board_cards == 5, "Only whole boards can be stratified"
+            self._cumulative = list(accumulate(texture_probabilities(cards)))
+            self._offset = rng.random()
+
+    def deal(self, hero: Sequence[int], trial: int) -> list[int]:
+        """Returns the scenario of `trial` without the cards of `hero`, as `cards` (reused by the next
+           deal)."""
+        dealer, num_board, num_opp = self._dealer, self.num_board_cards, self.num_opp_cards
+        num_rest = num_opp + self.num_hero_cards # the opps' cards, then the spares
+        if self._cumulative is None:
+            board = rest = dealer.deal((), num_board + num_rest)
+            rest_start = num_board
+        else:
+            stratum = min(bisect(self._cumulative, (self._offset + trial * _GOLDEN) % 1.0), len(BOARD_STRATA) - 1)
+            while board_texture(dealer.deal((), num_board)) != stratum:
+                pass
+            board = dealer.deck[:num_board]
+            rest, rest_start = dealer.deal(board, num_rest), 0
+        # Filled in the order board, opps (as the `num_filled`th card that isn't the hero's goes to
+        # slot (num_filled + num_opp) % len(cards)):
+        cards, total, num_filled = self.cards, len(self.cards), 0
+        for k in range(num_board):
+            if board[k] not in hero:
+                cards[num_opp + num_filled] = board[k]
+                num_filled += 1
+        for k in range(rest_start, rest_start + num_rest):
+            if num_filled == total:
+                break
+            if rest[k] not in hero:
+                cards[(num_filled + num_opp) % total] = rest[k]
+                num_filled += 1
+        return cards
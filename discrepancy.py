@@ -1,39 +1,57 @@
 """Given two sim results files, output info about discrepancies between lines."""
 
 from __future__ import annotations
+from typing import Optional
+import math
 import sys
+
+from main import EV
+from results_store import ResultsLine, parse_results_line
 import Utils
 
-def readlines(file: str) -> list[str]:
+def read_results(file: str) -> dict[tuple[str, int], ResultsLine]:
+    """Indexes the lines of a results file by their hand type and number of opps."""
     with open(file, 'r') as f:
-        return [line.strip() for line in f]
+        lines = (parse_results_line(line) for line in f if line.strip())
+        return {(line.hand_type, line.num_opps): line for line in lines}
 
-def get_components(line: str) -> tuple[str, float]:
-    equity_percentage = next(float(x[:-1]) for x in line.split() if x.endswith('%'))
-    text = ' '.join(x for x in line.split() if '#' not in x and '%' not in x)
-    return (text, equity_percentage)
+def z_score(ev_1: Optional[EV], ev_2: Optional[EV]) -> Optional[float]:
+    """The difference between the EVs in standard errors, if both have the number of hands."""
+    if ev_1 is None or ev_2 is None:
+        return None
+    std_error = math.hypot(ev_1.confidence_interval(), ev_2.confidence_interval()) / 1.96
+    if std_error == 0:
+        return 0.0 if ev_1.ev() == ev_2.ev() else math.inf
+    return (ev_1.ev() - ev_2.ev()) / std_error
 
 def main() -> None:
     Utils.pypy_notice()
-    shorter, longer = sorted((readlines(sys.argv[1]), readlines(sys.argv[2])), key=len)
-    missing_lines: list[tuple[str, float]] = []
-    equity_percent_diffs: list[tuple[str, float]] = []
-    for line in longer:
-        components = get_components(line)
-        other = next((t for x in shorter if (t := get_components(x))[0] == components[0]), None)
+    shorter, longer = sorted((read_results(sys.argv[1]), read_results(sys.argv[2])), key=len)
+    missing_lines: list[ResultsLine] = []
+    equity_percent_diffs: list[tuple[ResultsLine, float, Optional[float]]] = []
+    for key, line in longer.items():
+        other = shorter.get(key)
         if other is None:
-            missing_lines.append(components)
+            missing_lines.append(line)
             continue
-        equity_percent_diffs.append((components[0], abs(components[1] - other[1])))
+        equity_percent_diffs.append((line, abs(line.equity - other.equity), z_score(line.ev, other.ev)))
     equity_percent_diffs.sort(key=lambda d: d[1])
     print("\nChanges in equity percentage in sorted order:")
-    for diff in equity_percent_diffs:
-        print(f"{diff[0].split()[0]} has a change in equity percentage of {diff[1]}%")
+    for line, diff, z in equity_percent_diffs:
+        significance = ('' if z is None else
+                        f" (significant at 95% confidence, z = {abs(z):.2f})" if abs(z) > 1.96 else
+                        f" (within the noise, z = {abs(z):.2f})")
+        print(f"{line.hand_type} has a change in equity percentage of {round(diff, 3)}% "
+              f"vs {line.num_opps} opps{significance}")
     print(f"\nNum missing lines in the longer file but not the shorter: {len(missing_lines)}")
-    print('\n'.join(str(t) for t in missing_lines))
+    print('\n'.join(f"{line.hand_type} vs {line.num_opps} opps: {line.equity}%" for line in missing_lines))
     print(f'Average change in equity percentage: ' +
-          f'{sum(j for _, j in equity_percent_diffs) / len(equity_percent_diffs)}%')
+          f'{sum(j for _, j, _ in equity_percent_diffs) / len(equity_percent_diffs)}%')
+    if z_scores := [z for _, _, z in equity_percent_diffs if z is not None]:
+        num_significant = sum(abs(z) > 1.96 for z in z_scores)
+        print(f"{num_significant} out of {len(z_scores)} changes are significant at 95% confidence "
+              f"(about {round(len(z_scores) * 0.05)} would be by chance alone)")
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
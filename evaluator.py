@@ -0,0 +1,354 @@
+"""Table-driven hand evaluation on integer-encoded cards.
+
+A card is the int `4 * value + suit`, where `value` indexes `VALS` (so '2' is 0 and 'A' is 12) and
+`suit` indexes `SUITS`. An `Evaluator` maps five such cards to a single int strength: a greater int
+is a better hand, and equal ints split the pot."""
+
+from __future__ import annotations
+from itertools import combinations, combinations_with_replacement
+from typing import Iterable, Sequence
+
+VALS = '23456789TJQKA'
+SUITS = 'shdc'
+_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+# Per-card lookups, indexed by a card's int encoding:
+PRIME = tuple(_PRIMES[c >> 2] for c in range(52))
+BIT = tuple(1 << (c >> 2) for c in range(52))
+SUIT_BIT = tuple(1 << (c & 3) for c in range(52))
+
+HIGH_CARD, PAIR, TWO_PAIR, TRIPS, STRAIGHT, FLUSH, BOAT, QUADS, STRAIGHT_FLUSH = range(9)
+"""Hand categories, listed in their holdem order. Their actual order for a gametype is given by the
+   `ranks` passed to `Evaluator`."""
+
+CATEGORY_SHIFT = 20
+
+def _values_from_prime_product(prime_product: int) -> list[int]:
+    vals = []
+    for val, prime in enumerate(_PRIMES):
+        while prime_product % prime == 0:
+            prime_product //= prime
+            vals.append(val)
+    return vals
+
+def encode_card(card: str) -> int:
+    """`card` is a value char followed by a suit char, e.g. 'Th'."""
+    return VALS.index(card[0]) * 4 + SUITS.index(card[1])
+
+def decode_card(card: int) -> str:
+    return VALS[card >> 2] + SUITS[card & 3]
+
+def encode_cards(cards: str) -> list[int]:
+    """`cards` is a string like 'KhQh5c' (no spaces)."""
+    return [encode_card(cards[i:i+2]) for i in range(0, len(cards), 2)]
+
+def _strength(category_rank: int, kickers: Iterable[int]) -> int:
+    """Packs the category's rank above up to five 4-bit card values, most significant first."""
+    strength, shift = category_rank << CATEGORY_SHIFT, CATEGORY_SHIFT
+    for kicker in kickers:
+        shift -= 4
+        strength |= kicker << shift
+    return strength
+
+def category_rank(strength: int) -> int:
+    """Returns the rank of the hand's category, matching index 5 of a `compare.getBestComb` list."""
+    return strength >> CATEGORY_SHIFT
+
+class _UnsuitedTable(dict):
+    """Maps the product of the primes of 5 to 7 cards to the best non-flush strength they make.
+       Entries are filled in on first lookup, from the histogram of the card values."""
+    def __init__(self, evaluator: Evaluator):
+        super().__init__()
+        self._evaluator = evaluator
+
+    def __missing__(self, prime_product: int) -> int:
+        counts = [0] * len(VALS)
+        for val in _values_from_prime_product(prime_product):
+            counts[val] += 1
+        strength = self[prime_product] = self._evaluator.best_unsuited(counts)
+        return strength
+
+class Evaluator:
+    def __init__(self, ranks: dict[str, int], num_card_vals: int, omaha: bool):
+        """`ranks` and `num_card_vals` are the values `compare.GameRules` chooses for a gametype.
+           If `omaha` is true, a hand must use exactly two hole cards and three board cards."""
+        self.omaha = omaha
+        self.category_ranks = (0, 1, 2, ranks['trips'], ranks['straight'], ranks['flush'],
+                               ranks['boat'], 7, 8)
+        lowest = len(VALS) - num_card_vals
+        # (mask, high card) for every straight, best first; the last one is the wheel.
+        self.straights = tuple(
+            [(0b11111 << (high - 4), high) for high in range(len(VALS) - 1, lowest + 3, -1)] +
+            [((1 << (len(VALS) - 1)) | (0b1111 << lowest), lowest + 3)]
+        )
+        self._unsuited5: dict[int, int] = {}
+        """Maps the product of the five cards' primes to the hand's strength, when not a flush."""
+        self._flush5: dict[int, int] = {}
+        """Maps the OR of the five cards' bits to the hand's strength, when all have the same suit."""
+        for vals in combinations_with_replacement(range(len(VALS)), 5):
+            prime_product = 1
+            for val in vals:
+                prime_product *= _PRIMES[val]
+            if len(set(vals)) < 5:
+                if max(vals.count(v) for v in vals) <= 4:
+                    self._unsuited5[prime_product] = self._paired_strength(vals)
+                continue
+            mask = sum(1 << val for val in vals)
+            straight_high = self.straight_high(mask)
+            high_to_low = sorted(vals, reverse=True)
+            if straight_high is None:
+                self._unsuited5[prime_product] = self.strength(HIGH_CARD, high_to_low)
+                self._flush5[mask] = self.strength(FLUSH, high_to_low)
+            else:
+                self._unsuited5[prime_product] = self.strength(STRAIGHT, (straight_high,))
+                self._flush5[mask] = self.strength(STRAIGHT_FLUSH, (straight_high,))
+        self._unsuited7 = _UnsuitedTable(self)
+        self._flush7 = [0] * (1 << len(VALS))
+        """Indexed by the rank bitmask of all cards of one suit, gives the best flush they make (or 0
+           if there are fewer than five)."""
+        for mask in range(len(self._flush7)):
+            if bin(mask).count('1') >= 5:
+                straight_high = self.straight_high(mask)
+                self._flush7[mask] = (
+                    self.strength(STRAIGHT_FLUSH, (straight_high,)) if straight_high is not None else
+                    self.strength(FLUSH, [v for v in range(len(VALS) - 1, -1, -1) if mask >> v & 1][:5])
+                )
+        self._max_strength_below = [0] + [((max(self.category_ranks[:category]) + 1) << CATEGORY_SHIFT) - 1
+                                          for category in range(1, len(self.category_ranks) + 1)]
+        """Indexed by a category, gives an upper bound on the strengths of the categories before it."""
+        self.best_hand = self._best_omaha_hand if omaha else self._best_holdem_hand
+        """Takes the hole cards and the `prepare_board` info, and returns the best strength."""
+
+    def strength(self, category: int, kickers: Iterable[int]) -> int:
+        return _strength(self.category_ranks[category], kickers)
+
+    def straight_high(self, mask: int) -> int | None:
+        """Returns the high card of the best straight within the rank bitmask `mask`, if any."""
+        return next((high for straight, high in self.straights if mask & straight == straight), None)
+
+    def _paired_strength(self, vals: tuple[int, ...]) -> int:
+        """`vals` holds five card values with at least one repeated."""
+        # Order the values by (count, value), so the set comes before the pair, etc:
+        groups = sorted(((vals.count(v), v) for v in set(vals)), reverse=True)
+        counts = tuple(count for count, _ in groups)
+        kickers = [v for _, v in groups]
+        category = {(4,1): QUADS, (3,2): BOAT, (3,1,1): TRIPS, (2,2,1): TWO_PAIR,
+                    (2,1,1,1): PAIR}[counts]
+        return self.strength(category, kickers)
+
+    def best_unsuited(self, counts: Sequence[int]) -> int:
+        """`counts[v]` is the number of cards (5 to 7 in total) with value `v`. Returns the strength of
+           the best five card hand they make, ignoring flushes."""
+        present = [v for v in range(len(counts) - 1, -1, -1) if counts[v]]
+        pairs = [v for v in present if counts[v] >= 2]
+        sets = [v for v in present if counts[v] >= 3]
+        candidates = [self.strength(HIGH_CARD, present[:5])] if len(present) >= 5 else []
+        straight_high = self.straight_high(sum(1 << v for v in present))
+        if straight_high is not None:
+            candidates.append(self.strength(STRAIGHT, (straight_high,)))
+        if pairs:
+            candidates.append(self.strength(PAIR, [pairs[0]] + [v for v in present if v != pairs[0]][:3]))
+        if len(pairs) >= 2 and len(present) >= 3:
+            kicker = next(v for v in present if v not in pairs[:2])
+            candidates.append(self.strength(TWO_PAIR, (pairs[0], pairs[1], kicker)))
+        if sets:
+            candidates.append(self.strength(TRIPS, [sets[0]] + [v for v in present if v != sets[0]][:2]))
+            boat_pair = next((v for v in pairs if v != sets[0]), None)
+            if boat_pair is not None:
+                candidates.append(self.strength(BOAT, (sets[0], boat_pair)))
+            quads = next((v for v in sets if counts[v] == 4), None)
+            if quads is not None:
+                candidates.append(self.strength(QUADS, (quads, next(v for v in present if v != quads))))
+        return max(candidates)
+
+    def unsuited_table(self, num_cards: int, vals: Iterable[int]) -> dict[int, int]:
+        """Returns the best non-flush strength for every multiset of `num_cards` (5 or 7) values from
+           `vals`, keyed by the product of their primes."""
+        assert num_cards in (5, 7)
+        table = {}
+        for multiset in combinations_with_replacement(vals, num_cards):
+            if all(multiset.count(v) <= 4 for v in multiset):
+                prime_product = 1
+                for val in multiset:
+                    prime_product *= _PRIMES[val]
+                table[prime_product] = (self._unsuited5 if num_cards == 5 else self._unsuited7)[prime_product]
+        return table
+
+    def flush_table(self, num_cards: int) -> list[int]:
+        """Indexed by a rank bitmask of `num_cards` (5 or 7) cards of one suit, gives the best flush
+           they make (0 if there is none)."""
+        assert num_cards in (5, 7)
+        if num_cards == 7:
+            return list(self._flush7)
+        table = [0] * (1 << len(VALS))
+        for mask, strength in self._flush5.items():
+            table[mask] = strength
+        return table
+
+    def evaluate5(self, a: int, b: int, c: int, d: int, e: int) -> int:
+        if SUIT_BIT[a] & SUIT_BIT[b] & SUIT_BIT[c] & SUIT_BIT[d] & SUIT_BIT[e]:
+            return self._flush5[BIT[a] | BIT[b] | BIT[c] | BIT[d] | BIT[e]]
+        return self._unsuited5[PRIME[a] * PRIME[b] * PRIME[c] * PRIME[d] * PRIME[e]]
+
+    def best_strength(self, hole: Iterable[int], board: Iterable[int]) -> int:
+        """Returns the strength of the best five card hand by trying every allowed combo of hole and
+           board cards. Slower than `best_hand`, but useful as a reference."""
+        hole, board = tuple(hole), tuple(board)
+        evaluate5 = self.evaluate5
+        best = 0
+        for num_board_cards in ((3,) if self.omaha else range(3, 6)):
+            for board_comb in combinations(board, num_board_cards):
+                for hole_comb in combinations(hole, 5 - num_board_cards):
+                    strength = evaluate5(*board_comb, *hole_comb)
+                    if strength > best:
+                        best = strength
+        return best
+
+    def prepare_board(self, board: Sequence[int]) -> tuple:
+        """Does the work that only depends on the five board cards, so it can be shared by every
+           player's `best_hand` call."""
+        if self.omaha:
+            triples = tuple(combinations(board, 3))
+            flush_masks: list[list[int]] = [[], [], [], []]
+            for a, b, c in triples:
+                if SUIT_BIT[a] & SUIT_BIT[b] & SUIT_BIT[c]:
+                    flush_masks[a & 3].append(BIT[a] | BIT[b] | BIT[c])
+            return tuple(PRIME[a] * PRIME[b] * PRIME[c] for a, b, c in triples), tuple(flush_masks)
+        prime_product, suit_masks = 1, [0, 0, 0, 0]
+        for card in board:
+            prime_product *= PRIME[card]
+            suit_masks[card & 3] |= BIT[card]
+        flush7 = self._flush7
+        return prime_product, suit_masks, max(flush7[mask] for mask in suit_masks)
+
+    def prepare_partial_board(self, known: Sequence[int]) -> tuple:
+        """Does the work that only depends on the known board cards (e.g. a flop), so that
+           `complete_board` can reuse it for every runout."""
+        if self.omaha:
+            # The prime product, common suit bits and val bits of each combo of the known cards, by
+            # the size of the combo:
+            combos: list[list[tuple[int, int, int]]] = [[] for _ in range(4)]
+            for size in range(4):
+                for comb in combinations(known, size):
+                    product, suits, bits = 1, 15, 0
+                    for card in comb:
+                        product *= PRIME[card]
+                        suits &= SUIT_BIT[card]
+                        bits |= BIT[card]
+                    combos[size].append((product, suits, bits))
+            # ...and the board triples that are all known cards:
+            flush_masks: list[list[int]] = [[], [], [], []]
+            for _, suits, bits in combos[3]:
+                if suits:
+                    flush_masks[suits.bit_length() - 1].append(bits)
+            return combos, [product for product, _, _ in combos[3]], flush_masks
+        prime_product, suit_masks = 1, [0, 0, 0, 0]
+        for card in known:
+            prime_product *= PRIME[card]
+            suit_masks[card & 3] |= BIT[card]
+        return prime_product, tuple(suit_masks)
+
+    def complete_board(self, partial: tuple, rest: Sequence[int]) -> tuple:
+        """Returns what `prepare_board` would for the board of the known cards of `partial` (from
+           `prepare_partial_board`) and `rest`."""
+        if self.omaha:
+            combos, known_products, known_flush_masks = partial
+            products = list(known_products)
+            flush_masks = [list(masks) for masks in known_flush_masks]
+            # Every triple with at least one card of `rest`, as a combo of `rest` and one of the known cards:
+            for size in range(1, min(3, len(rest)) + 1):
+                for rest_comb in combinations(rest, size):
+                    rest_product, rest_suits, rest_bits = 1, 15, 0
+                    for card in rest_comb:
+                        rest_product *= PRIME[card]
+                        rest_suits &= SUIT_BIT[card]
+                        rest_bits |= BIT[card]
+                    for product, suits, bits in combos[3 - size]:
+                        products.append(product * rest_product)
+                        if suits & rest_suits:
+                            flush_masks[(suits & rest_suits).bit_length() - 1].append(bits | rest_bits)
+            return tuple(products), tuple(flush_masks)
+        prime_product, known_masks = partial
+        suit_masks = list(known_masks)
+        for card in rest:
+            prime_product *= PRIME[card]
+            suit_masks[card & 3] |= BIT[card]
+        flush7 = self._flush7
+        return prime_product, suit_masks, max(flush7[mask] for mask in suit_masks)
+
+    def prepare_bounds(self, board: Sequence[int]) -> tuple[int, int, frozenset[int]] | None:
+        """For Omaha, does the work that `strength_bound` needs from the five board cards: the
+           board's val bits, the bits of the suits it has 3+ cards of, and the val bits of every pair
+           of hole cards that would make a straight with it. Returns None if the board is paired,
+           as then boats and quads are possible, and aren't bounded."""
+        assert self.omaha
+        board_vals, suit_counts = 0, [0, 0, 0, 0]
+        for card in board:
+            if board_vals & BIT[card]:
+                return None
+            board_vals |= BIT[card]
+            suit_counts[card & 3] += 1
+        flush_suits = sum(1 << suit for suit in range(4) if suit_counts[suit] >= 3)
+        straight_draws = set()
+        for straight, _ in self.straights:
+            on_board = [1 << v for v in range(len(VALS)) if (straight & board_vals) >> v & 1]
+            for a, b, c in combinations(on_board, 3):
+                straight_draws.add(straight ^ (a | b | c))
+        return board_vals, flush_suits, frozenset(straight_draws)
+
+    def strength_bound(self, hole: Sequence[int], bounds: tuple[int, int, frozenset[int]]) -> int:
+        """Returns an upper bound on the strength of the best Omaha hand of `hole`, from the best
+           category it could make with the unpaired board of `bounds` (from `prepare_bounds`). It's
+           much cheaper than `best_hand`, so it can rule out opps who can't beat or tie a hand."""
+        board_vals, flush_suits, straight_draws = bounds
+        a, b, c, d = hole
+        if flush_suits:
+            for x, y in ((a, b), (a, c), (a, d), (b, c), (b, d), (c, d)):
+                if x & 3 == y & 3 and flush_suits >> (x & 3) & 1:
+                    return self._max_strength_below[STRAIGHT_FLUSH + 1]
+        bit_a, bit_b, bit_c, bit_d = BIT[a], BIT[b], BIT[c], BIT[d]
+        if straight_draws and ((bit_a | bit_b) in straight_draws or (bit_a | bit_c) in straight_draws or
+                               (bit_a | bit_d) in straight_draws or (bit_b | bit_c) in straight_draws or
+                               (bit_b | bit_d) in straight_draws or (bit_c | bit_d) in straight_draws):
+            category = STRAIGHT
+        else:
+            pocket_pairs = (bit_a & (bit_b | bit_c | bit_d)) | (bit_b & (bit_c | bit_d)) | (bit_c & bit_d)
+            on_board = (bit_a | bit_b | bit_c | bit_d) & board_vals
+            category = (TRIPS if pocket_pairs & board_vals else
+                        TWO_PAIR if on_board & (on_board - 1) else # 2+ vals
+                        PAIR if on_board or pocket_pairs else
+                        HIGH_CARD)
+        return self._max_strength_below[category + 1]
+
+    def _best_holdem_hand(self, hole: Sequence[int], board_info: tuple) -> int:
+        """Finds the best of any 5 of the 7 cards directly, from the histogram of their values
+           (via their prime product) and the bitmask of each suit."""
+        prime_product, suit_masks, best = board_info
+        flush7 = self._flush7
+        for card in hole:
+            prime_product *= PRIME[card]
+        for card in hole:
+            mask = suit_masks[card & 3]
+            if mask:
+                for other in hole:
+                    if other & 3 == card & 3:
+                        mask |= BIT[other]
+                if flush7[mask] > best:
+                    best = flush7[mask]
+        unsuited = self._unsuited7[prime_product]
+        return unsuited if unsuited > best else best
+
+    def _best_omaha_hand(self, hole: Sequence[int], board_info: tuple) -> int:
+        board_products, flush_masks = board_info
+        unsuited5, flush5 = self._unsuited5, self._flush5
+        hole_pairs = tuple(combinations(hole, 2))
+        best = max([unsuited5[PRIME[a] * PRIME[b] * board_product]
+                    for a, b in hole_pairs for board_product in board_products])
+        if any(flush_masks):
+            for a, b in hole_pairs:
+                if a & 3 == b & 3:
+                    for board_mask in flush_masks[a & 3]:
+                        strength = flush5[BIT[a] | BIT[b] | board_mask]
+                        if strength > best:
+                            best = strength
+        return best
@@ -0,0 +1,128 @@
+"""Opt-in stats on where the time goes in simulations: time per phase (dealing, evaluation, comparison
+and I/O), trials per second, the ETA of a sweep, and the distribution of hand categories (of the
+hero's hands in `run_sims`, since the opps that get evaluated depend on the hero's hand, and of both
+hands in versus.py).
+
+Nothing is collected unless `enable` is called: the hot loops fetch `active()` once, and only do any
+of the work (even reading the clock) when it isn't None. Progress is emitted as one JSON object per
+line, and `report` gives the final stats as a JSON-ready dict."""
+
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import ContextManager, Iterable, Iterator, Optional, Sequence
+import json
+
+import compare
+import evaluator
+
+CATEGORY_NAMES = ('high card', 'pair', 'two pair', 'trips', 'straight', 'flush', 'boat', 'quads',
+                  'straight flush')
+"""Indexed by the category constants in evaluator.py."""
+
+class Instrumentation:
+    def __init__(self) -> None:
+        self.start = perf_counter()
+        self.trials = 0
+        self.phase_seconds: dict[str, float] = {}
+        self.category_counts = [0] * len(CATEGORY_NAMES)
+        """Indexed by category rank (`evaluator.category_rank`), which depends on the gametype."""
+        self.tasks_total: Optional[int] = None
+        self.tasks_done = 0
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    def record_trials(self, num_trials: int, start: float, dealt: float, evaluated: float,
+                      compared: float) -> None:
+        """Takes the `perf_counter` times at the start of the trials and after each phase."""
+        self.trials += num_trials
+        self.add_time('dealing', dealt - start)
+        self.add_time('evaluation', evaluated - dealt)
+        self.add_time('comparison', compared - evaluated)
+
+    def count_strengths(self, strengths: Iterable[int]) -> None:
+        for strength in strengths:
+            self.category_counts[strength >> evaluator.CATEGORY_SHIFT] += 1
+
+    def add_category_counts(self, counts: Sequence[int]) -> None:
+        """`counts` is indexed by category rank, as in `category_counts`."""
+        for category_rank, num_hands in enumerate(counts):
+            self.category_counts[category_rank] += int(num_hands)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start)
+
+    def take(self) -> Instrumentation:
+        """Returns the trials, phase times and categories collected so far, and resets them here (so
+           that a worker process can hand them to the parent, to `merge`)."""
+        taken = Instrumentation()
+        taken.trials, taken.phase_seconds, taken.category_counts = (
+            self.trials, self.phase_seconds, self.category_counts
+        )
+        self.trials, self.phase_seconds, self.category_counts = 0, {}, [0] * len(CATEGORY_NAMES)
+        return taken
+
+    def merge(self, other: Instrumentation) -> None:
+        self.trials += other.trials
+        for phase, seconds in other.phase_seconds.items():
+            self.add_time(phase, seconds)
+        self.add_category_counts(other.category_counts)
+
+    def task_done(self) -> None:
+        self.tasks_done += 1
+        self.log_progress()
+
+    def eta_seconds(self) -> Optional[float]:
+        if not self.tasks_total or not self.tasks_done:
+            return None
+        return (perf_counter() - self.start) / self.tasks_done * (self.tasks_total - self.tasks_done)
+
+    def report(self) -> dict:
+        elapsed = perf_counter() - self.start
+        category_of_rank = {rank: category for category, rank in
+                            enumerate(compare.evaluator().category_ranks)}
+        total_hands = sum(self.category_counts)
+        return {
+            'gametype': compare.gametype().name.lower(),
+            'elapsed_seconds': round(elapsed, 3),
+            'trials': self.trials,
+            'trials_per_second': round(self.trials / elapsed, 1) if elapsed else None,
+            'tasks_done': self.tasks_done,
+            'tasks_total': self.tasks_total,
+            'eta_seconds': None if (eta := self.eta_seconds()) is None else round(eta, 1),
+            # In a parallel sweep, these add up the time of every worker:
+            'phase_seconds': {phase: round(seconds, 3) for phase, seconds in self.phase_seconds.items()},
+            'hand_categories': {CATEGORY_NAMES[category_of_rank[rank]]: round(count / total_hands, 6)
+                                for rank, count in enumerate(self.category_counts)
+                                if count and rank in category_of_rank},
+        }
+
+    def log_progress(self) -> None:
+        report = self.report()
+        print(json.dumps({'event': 'progress', **{key: report[key] for key in (
+            'elapsed_seconds', 'trials', 'trials_per_second', 'tasks_done', 'tasks_total', 'eta_seconds'
+        )}}))
+
+_active: Optional[Instrumentation] = None
+
+def enable() -> Instrumentation:
+    global _active
+    _active = Instrumentation()
+    return _active
+
+def disable() -> None:
+    global _active
+    _active = None
+
+def active() -> Optional[Instrumentation]:
+    return _active
+
+def phase(name: str) -> ContextManager:
+    """Times a block as the phase `name`, if instrumentation is enabled."""
+    return _active.phase(name) if _active else nullcontext()
@@ -1,16 +1,24 @@
 from __future__ import annotations
 import random
-from itertools import product, combinations_with_replacement, combinations, permutations, chain
-from dataclasses import dataclass
-from time import time
+from itertools import product, combinations_with_replacement, combinations, permutations, chain, count
+from dataclasses import dataclass, field
+from time import perf_counter, time
 import sys
+import json
 from datetime import datetime
 import os
-from typing import Iterable, Optional
-from functools import cmp_to_key
+import math
+import uuid
+from typing import Callable, Iterable, Iterator, Optional, Protocol, Sequence
+from functools import cmp_to_key, partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import compare
-from compare import GameType, gametype, num_hole_cards
+from compare import GameRules, GameType, gametype
+import evaluator
+from checkpoint import Checkpoints
+from dealer import Dealer, ScenarioDealer
+import instrumentation
 import Utils
 
 SHORTDECK_VALS = '6789TJQKA'
@@ -49,13 +57,6 @@ class OmahaSuitType:
             sorted((''.join(sorted(g, key=card_val_key)) for g in card_groupsP), key=OmahaSuitType.group_key)
         )
 
-    def generate_concrete_hand(self) -> list[Card]:
-        assert self.well_formed()
-        return sorted(
-            (Card(card_val, SUITS[i]) for i, suit_group in enumerate(self.card_groups)
-                                      for card_val in suit_group), key=card_val_key
-        )
-
     def well_formed(self) -> bool:
         return (sum(len(group) for group in self.card_groups) == 4 and
                 all(len(group) == len(set(group)) for group in self.card_groups))
@@ -72,21 +73,48 @@ class OmahaSuitType:
         assert self.well_formed()
         return '.'.join(self.card_groups)
 
+    def num_combos(self) -> int:
+        """Returns how many concrete hands (out of the 270725 in a full deck) belong to this class."""
+        assert self.well_formed()
+        # Each group gets its own suit, but swapping the suits of identical groups gives the same hand:
+        num_suit_assignments = math.perm(len(SUITS), len(self.card_groups))
+        for group in set(self.card_groups):
+            num_suit_assignments //= math.factorial(self.card_groups.count(group))
+        return num_suit_assignments
+
+    def concrete_hands(self) -> list[tuple[int, ...]]:
+        """Returns every concrete hand in this class, as descending tuples of int-encoded cards."""
+        assert self.well_formed()
+        return sorted({tuple(sorted((evaluator.VALS.index(val) * 4 + suit
+                                     for group, suit in zip(self.card_groups, suits) for val in group),
+                                    reverse=True))
+                       for suits in permutations(range(len(SUITS)), len(self.card_groups))})
+
+    @staticmethod
+    def _canonical_groups(val_counts: dict[str, int], prev_group: Optional[str]) -> Iterator[tuple[str, ...]]:
+        """Yields each way to split the cards in `val_counts` into suit groups, with the groups in the
+           order `__init__` sorts them into (and none of them sorting before `prev_group`). Since each
+           split comes out in only one order, no split is yielded twice."""
+        vals = [val for val in val_counts if val_counts[val]]
+        if not vals:
+            yield ()
+            return
+        for size in range(1, len(vals) + 1):
+            for group_vals in combinations(vals, size):
+                group = ''.join(group_vals)
+                if prev_group is not None and OmahaSuitType.group_key(group) < OmahaSuitType.group_key(prev_group):
+                    continue
+                remaining = {val: count - (val in group_vals) for val, count in val_counts.items()}
+                for rest in OmahaSuitType._canonical_groups(remaining, group):
+                    yield (group,) + rest
+
     @staticmethod
     def all_hand_types() -> list[OmahaSuitType]:
-        card_vals = HOLDEM_VALS[::-1]
-        objects: list[OmahaSuitType] = []
-        for comb in combinations_with_replacement(card_vals, 4):
-            first_2, evens, beg_end, mid_2, odds, last_2 = combinations(comb, 2)
-            objects.extend(chain(
-                (OmahaSuitType(comb),),
-                (OmahaSuitType(comb[:x], comb[x:]) for x in (1,2,3)),
-                (OmahaSuitType(x, *y) for x,y in permutations((first_2, last_2))),
-                (OmahaSuitType((comb[0], comb[x], comb[3]), comb[y]) for x,y in ((1,2), (2,1))),
-                (OmahaSuitType(*x, *y) for x,y in chain(product((evens, [evens]), (odds, [odds])),
-                                                        product(([beg_end], beg_end), ([mid_2], mid_2))))
-            ))
-        objects = list(set(o for o in objects if o.well_formed()))
+        objects = [OmahaSuitType(*groups)
+                   for comb in combinations_with_replacement(HOLDEM_VALS[::-1], 4)
+                   for groups in OmahaSuitType._canonical_groups(
+                       {val: comb.count(val) for val in sorted(set(comb), key=card_val_key)}, None
+                   )]
         assert len(objects) == 16432
         return objects
 
@@ -103,49 +131,126 @@ class Card:
     def __hash__(self):
         return hash((self.val, self.suit))
 
+class NamedHandType(Protocol):
+    """What an `EV` needs of its hand type: a `HandType`, or a stand-in for one read back from saved
+       results."""
+    def num_combos(self) -> int: ...
+    def __str__(self) -> str: ...
+
 @dataclass
 class EV:
-    # also, update class so that it keeps track of #wins, #losses, and #splits. The #wins is diff
-    # from `pots_won`, it'd be the number of full pots won. User may just be interested in this info.
-    hand_type: Optional[HandType2Cards | HandType4Cards] = None
+    """The results of a hand type's trials. Results recorded with `add_result` also keep count of full
+       pots won, splits (by the number of ways the pot was split) and losses; EVs can be combined
+       with `merge`, in any order, without losing any of this."""
+    hand_type: Optional[NamedHandType] = None
     pots_won: float = 0
     hands_played: int = 0
+    pots_won_squared: float = 0
+    """The sum of the square of the amount of the pot won in each hand, for the variance."""
+    wins: int = 0
+    losses: int = 0
+    splits: dict[int, int] = field(default_factory=dict)
+    """The number of hands where the pot was split, keyed by the number of ways it was split."""
+    exact: bool = False
+    """Whether these are the results of every deal (e.g. from `ranges.equity`) rather than of a sample
+       of them, in which case there's no confidence interval."""
+
+    def add_result(self, num_winners: int, count: int = 1) -> None:
+        """Records `count` hands where the pot went to `num_winners` players including this one
+           (or to other players only, if `num_winners` is 0)."""
+        if num_winners == 0:
+            self.losses += count
+        elif num_winners == 1:
+            self.wins += count
+        else:
+            self.splits[num_winners] = self.splits.get(num_winners, 0) + count
+        if num_winners:
+            self.pots_won += count / num_winners
+            self.pots_won_squared += count / num_winners ** 2
+        self.hands_played += count
+
+    def merge(self, other: EV) -> EV:
+        """Returns the EV of the trials of both `self` and `other` (which are left unchanged)."""
+        assert (self.hand_type is None or other.hand_type is None or
+                str(self.hand_type) == str(other.hand_type))
+        splits = dict(self.splits)
+        for num_ways, count in other.splits.items():
+            splits[num_ways] = splits.get(num_ways, 0) + count
+        return EV(self.hand_type or other.hand_type, self.pots_won + other.pots_won,
+                  self.hands_played + other.hands_played, self.pots_won_squared + other.pots_won_squared,
+                  self.wins + other.wins, self.losses + other.losses, splits, self.exact and other.exact)
+
+    def state(self) -> dict:
+        """The totals of the EV, in a form that can be saved as JSON."""
+        return {'pots_won': self.pots_won, 'hands_played': self.hands_played,
+                'pots_won_squared': self.pots_won_squared, 'wins': self.wins, 'losses': self.losses,
+                'splits': {str(num_ways): count for num_ways, count in self.splits.items()}}
 
-    def update(self, amount_of_pot_won: float) -> None:
-        self.pots_won += amount_of_pot_won
-        self.hands_played += 1
+    @staticmethod
+    def from_state(hand_type: Optional[NamedHandType], state: dict) -> EV:
+        return EV(hand_type, state['pots_won'], int(state['hands_played']), state['pots_won_squared'],
+                  state.get('wins', 0), state.get('losses', 0),
+                  {int(num_ways): count for num_ways, count in state.get('splits', {}).items()})
 
     def ev(self) -> float:
         """Returns EV as a percentage of the pot"""
         return round(self.pots_won / self.hands_played * 100, 3)
 
+    def confidence_interval(self, z: float = 1.96) -> float:
+        """Returns the half-width of the confidence interval of the EV, as a percentage of the pot.
+           The default `z` is for 95% confidence. An exact EV's interval has no width."""
+        if self.exact:
+            return 0.0
+        if self.hands_played < 2:
+            return float('inf')
+        mean = self.pots_won / self.hands_played
+        variance = max(self.pots_won_squared / self.hands_played - mean ** 2, 0.0)
+        variance *= self.hands_played / (self.hands_played - 1)
+        return round(z * math.sqrt(variance / self.hands_played) * 100, 3)
+
+    def has_counts(self) -> bool:
+        """Whether every hand's result was counted as a win, split or loss (which results read back
+           from before they were counted, or merged with such results, weren't)."""
+        return self.wins + self.losses + sum(self.splits.values()) == self.hands_played
+
     def __str__(self) -> str:
         assert self.hand_type is not None
-        return f"{self.hand_type} wins {self.ev()}% of the pot on avg"
-
-@dataclass
+        counts = ''
+        if self.has_counts():
+            ways = ', '.join(f"{num_ways}-way: {count}" for num_ways, count in sorted(self.splits.items()))
+            counts = (f"; {self.wins} wins, {sum(self.splits.values())} splits" +
+                      (f" ({ways})" if ways else '') + f", {self.losses} losses")
+        return (f"{self.hand_type} wins {self.ev()}% of the pot on avg "
+                f"(±{self.confidence_interval()}% at 95% confidence, {self.hands_played} hands, "
+                f"{self.hand_type.num_combos()} combos{counts})")
+
+@dataclass(frozen=True)
 class HandType2Cards:
     card1_val: str
     card2_val: str
     suited: bool
     # todo - enforce that card1_val has a higher value than card2_val?
 
-    def generate_concrete_hand(self) -> list[Card]:
-        """Returns a list of `Card`s that matches the requirements"""
-        return [Card(self.card1_val, 'd'), Card(self.card2_val, ('d' if self.suited else 'h'))]
-
     def __post_init__(self) -> None:
         assert self.card1_val != self.card2_val or not self.suited
 
+    def num_combos(self) -> int:
+        return 6 if self.card1_val == self.card2_val else 4 if self.suited else 12
+
+    def concrete_hands(self) -> list[tuple[int, ...]]:
+        """Returns every concrete hand of this type, as descending tuples of int-encoded cards."""
+        val1, val2 = evaluator.VALS.index(self.card1_val) * 4, evaluator.VALS.index(self.card2_val) * 4
+        return [tuple(sorted((val1 + suit1, val2 + suit2), reverse=True))
+                for suit1, suit2 in product(range(len(SUITS)), repeat=2)
+                if (suit1 == suit2) == self.suited and (val1 != val2 or suit1 < suit2)]
+
     def __str__(self) -> str:
         return (self.card1_val + self.card2_val +
                 ('' if self.card1_val == self.card2_val else 's' if self.suited else 'o'))
 
     @staticmethod
-    def all_hand_types() -> list[HandType2Cards]:
-        card_vals = (SHORTDECK_VALS if gametype() in (
-            GameType.SHORTDECK, GameType.SHORTDECK_TRIPS
-        ) else HOLDEM_VALS)[::-1]
+    def all_hand_types(rules: Optional[GameRules] = None) -> list[HandType2Cards]:
+        card_vals = compare.game_rules(rules).card_vals[::-1]
         hand_types: list[HandType2Cards] = []
         for card1_val, card2_val in combinations_with_replacement(card_vals, 2):
             hand_types.append(HandType2Cards(card1_val, card2_val, False))
@@ -158,15 +263,17 @@ class HandType4Cards:
         # todo - enforce that the card vals are in order of value?
         # also, consider adding a param that says double suited, rainbow, single suited, random, etc.
         self._card_vals = card_vals
-        self._possible_cards = [[Card(card_val, s) for s in SUITS] for card_val in card_vals]
 
-    def generate_concrete_hand(self) -> list[Card]:
-        hand: list[Card] = []
-        for options in self._possible_cards:
-            while (pick := random.choice(options)) in hand:
-                pass
-            hand.append(pick)
-        return hand
+    def num_combos(self) -> int:
+        return math.prod(math.comb(len(SUITS), self._card_vals.count(val)) for val in set(self._card_vals))
+
+    def concrete_hands(self) -> list[tuple[int, ...]]:
+        """Returns every concrete hand with these vals, as descending tuples of int-encoded cards."""
+        vals = sorted(set(self._card_vals), key=card_val_key)
+        suit_choices = [combinations(range(len(SUITS)), self._card_vals.count(val)) for val in vals]
+        return [tuple(sorted((evaluator.VALS.index(val) * 4 + suit
+                              for val, suits in zip(vals, choice) for suit in suits), reverse=True))
+                for choice in product(*suit_choices)]
 
     def __str__(self) -> str:
         return ''.join(val for val in self._card_vals)
@@ -174,55 +281,162 @@ class HandType4Cards:
     def __eq__(self, other) -> bool:
         return isinstance(other, HandType4Cards) and self._card_vals == other._card_vals
 
+    def __hash__(self):
+        return hash(self._card_vals)
+
     @staticmethod
-    def all_hand_types() -> list[HandType4Cards]:
-        card_vals = (SHORTDECK_VALS if gametype() in (
-            GameType.SHORTDECK, GameType.SHORTDECK_TRIPS
-        ) else HOLDEM_VALS)[::-1]
+    def all_hand_types(rules: Optional[GameRules] = None) -> list[HandType4Cards]:
+        card_vals = compare.game_rules(rules).card_vals[::-1]
         return [HandType4Cards(comb) for comb in combinations_with_replacement(card_vals, 4)]
 
-def cards_as_str(cards: list[Card]) -> str:
-    """Used for debugging"""
-    return ' '.join(str(card) for card in sorted(cards, key=card_val_key))
-
-def run_sim(hand_type: HandType2Cards | HandType4Cards, num_opps: int, debug: bool = False) -> EV:
-    # todo - update so that the sim is run for num_opps and all positive ints less than it as well.
-    # Just saves a bunch of time.
-    CARD_VALS = SHORTDECK_VALS if gametype() in (
-        GameType.SHORTDECK, GameType.SHORTDECK_TRIPS
-    ) else HOLDEM_VALS
-    ALL_CARDS = {Card(*x) for x in product(CARD_VALS, SUITS)}
-    ev = EV(hand_type=hand_type)
-    num_trials = 100000
-    for i in range(num_trials):
-        assert len(ALL_CARDS) == 52
-        hand = hand_type.generate_concrete_hand()
-        rem_cards = ALL_CARDS - {*hand}
-        assert len(rem_cards) == 52 - num_hole_cards()
+HandType = HandType2Cards | HandType4Cards | OmahaSuitType
+
+def cards_as_str(cards: Iterable[int]) -> str:
+    """Used for debugging, with int-encoded cards (see evaluator.py)."""
+    return ' '.join(evaluator.decode_card(card) for card in sorted(cards, reverse=True))
+
+DEFAULT_NUM_TRIALS = 100000
+CHECKPOINT_INTERVAL = 10000
+"""How many trials are played between calls of the `on_progress` callback of `run_sims`."""
+SAMPLING_MODES = ('independent', 'common', 'stratified')
+"""How `run_sims` deals the opps and the board (see there)."""
+PRECISION_CHECK_INTERVAL = 1000
+"""With a target precision, how many trials are played between checks of the confidence intervals
+   (and the minimum number of trials, so that the intervals are meaningful)."""
+
+def trials_limit(precision: Optional[float], max_trials: Optional[int]) -> Optional[int]:
+    """Returns the number of trials to stop at, or None if only `precision` can stop the simulation."""
+    return DEFAULT_NUM_TRIALS if precision is None and max_trials is None else max_trials
+
+def precise_enough(evs: dict[int, EV], precision: Optional[float]) -> bool:
+    """Returns whether every EV's 95% confidence interval is within ±`precision` percent of the pot."""
+    return precision is not None and all(
+        ev.hands_played >= PRECISION_CHECK_INTERVAL and ev.confidence_interval() <= precision
+        for ev in evs.values()
+    )
+
+def run_sims(hand_type: HandType, min_opps: int, max_opps: int,
+             debug: bool = False, seed: Optional[int] = None, precision: Optional[float] = None,
+             max_trials: Optional[int] = None, initial_evs: Optional[dict[int, EV]] = None,
+             on_progress: Optional[Callable[[dict[int, EV]], None]] = None,
+             rules: Optional[GameRules] = None, board: Sequence[int] = (),
+             sampling: str = 'independent') -> dict[int, EV]:
+    """Simulates `hand_type` against every number of opps from `min_opps` to `max_opps`, in one pass:
+       each trial deals `max_opps` opps, and the result against the first k of them counts towards the
+       `EV` for k opps. If `seed` is given, the trials are dealt from a `random.Random` seeded with it,
+       so that the results can be reproduced. The cards are dealt by a `Dealer`, so no sets or lists of
+       cards are built per trial.
+
+       If `precision` is given, trials stop once every EV's 95% confidence interval is within
+       ±`precision` percent of the pot (or `max_trials` is reached, if given). Otherwise,
+       `max_trials` (by default `DEFAULT_NUM_TRIALS`) trials are run.
+
+       To continue a partly finished simulation, pass its EVs as `initial_evs` (the trials already in
+       them count towards `max_trials`). `on_progress` is called with the EVs every
+       `CHECKPOINT_INTERVAL` trials. The game is played by `rules` (by default, those of the current
+       gametype).
+
+       `board` holds the known community cards, if any (e.g. a flop): only the rest of the board is
+       dealt, and the work that only depends on the known cards is done once.
+
+       `sampling` is one of `SAMPLING_MODES`. By default, each trial deals the opps and the board from
+       the cards the hero's hand leaves. With 'common', they're dealt by a `ScenarioDealer` instead,
+       so that (with the same `seed`) every hand type faces the same opps and boards, and the noise in
+       the differences between hand types mostly cancels out; 'stratified' also stratifies the boards
+       by texture (so it can't be used with a known `board`)."""
+    assert sampling in SAMPLING_MODES, f"Unknown sampling mode {sampling}"
+    rules = compare.game_rules(rules)
+    evs = initial_evs or {num_opps: EV(hand_type=hand_type) for num_opps in range(min_opps, max_opps+1)}
+    rng = random.Random(seed)
+    known = set(board)
+    # Every concrete hand of the type (that the board doesn't block) is equally likely, so each trial
+    # picks one of them:
+    hands = [hand for hand in hand_type.concrete_hands() if not known.intersection(hand)]
+    assert hands, f"The board blocks every hand of {hand_type}"
+    num_hands = len(hands)
+    h = rules.num_hole_cards
+    board_start = h * max_opps
+    num_dealt = 5 - len(board)
+    cards = [card for card in rules.deck if card not in known]
+    if sampling == 'independent':
+        dealer = Dealer(cards, rng)
+        deal: Callable[[Sequence[int], int], list[int]] = lambda hand, _: dealer.deal(hand, board_start + num_dealt)
+    else:
+        scenarios = ScenarioDealer(cards, rng, board_start, num_dealt, h, stratified=sampling == 'stratified')
+        deal = scenarios.deal
+    best_hand = rules.evaluator.best_hand
+    prepare_bounds, strength_bound = rules.evaluator.prepare_bounds, rules.evaluator.strength_bound
+    min_bounded = rules.evaluator.strength(evaluator.TWO_PAIR, ())
+    if board:
+        partial_board, complete_board = rules.evaluator.prepare_partial_board(board), rules.evaluator.complete_board
+        finish_board: Callable[[Sequence[int]], tuple] = lambda rest: complete_board(partial_board, rest)
+    else:
+        finish_board = rules.evaluator.prepare_board
+    strengths = [0] * (max_opps + 1)
+    num_trials = trials_limit(precision, max_trials)
+    trials_done = evs[max_opps].hands_played
+    stats = instrumentation.active()
+    for i in count(trials_done):
+        if ((num_trials is not None and i >= num_trials) or
+            (i % PRECISION_CHECK_INTERVAL == 0 and precise_enough(evs, precision))):
+            break
+        if on_progress and i % CHECKPOINT_INTERVAL == 0 and i > trials_done:
+            on_progress(evs)
+        if stats:
+            start = perf_counter()
         if i % 50000 == 0 and i > 0:
-            print(f"EV: {str(ev)}")
-        opp_hands: list[list[Card]] = []
-        for _ in range(num_opps):
-            opp_hand = random.sample(list(rem_cards), num_hole_cards())
-            rem_cards -= {*opp_hand}
-            opp_hands.append(opp_hand)
-        assert len(rem_cards) == 52 - num_hole_cards() * (num_opps + 1)
-        comm_cards = random.sample(list(rem_cards), 5)
-        best_hands = [hand]
-        for opp_hand in opp_hands:
-            if hand != best_hands[0]:
-                break
-            new_hand_btr = compare.is_first_hand_better(''.join(str(x) for x in opp_hand) + ' ' +
-                ''.join(str(x) for x in best_hands[0]) + ' ' + ''.join(str(x) for x in comm_cards))
-            if new_hand_btr:
-                best_hands = [opp_hand]
-            elif new_hand_btr is None:
-                best_hands.append(opp_hand)
+            print(f"EV: {str(evs[max_opps])} vs {max_opps} opps")
+        hand = hands[int(rng.random() * num_hands)]
+        # The opps' hands are the first `board_start` cards of the deck, and the rest of the board the
+        # next `num_dealt`:
+        deck = deal(hand, i)
+        if stats:
+            dealt = perf_counter()
+        board_info = finish_board(deck[board_start:board_start+num_dealt])
+        hero = strengths[0] = best_hand(hand, board_info)
+        # An opp can only be ruled out by a bound when the hero has two pair or better:
+        bounds = (prepare_bounds([*board, *deck[board_start:board_start+num_dealt]])
+                  if rules.omaha and hero >= min_bounded else None)
+        if debug:
+            print(f'hand: {cards_as_str(hand)} (strength {hero})')
+            print(f"Community:\n{cards_as_str([*board, *deck[board_start:board_start+num_dealt]])}")
+        # The opps are only evaluated until one beats the hero, which decides the trial:
+        num_looked_at = max_opps
+        for num_opps in range(1, max_opps+1):
+            opp_hand = deck[(num_opps-1)*h:num_opps*h]
+            if bounds is not None and strength_bound(opp_hand, bounds) < hero:
+                strength = strengths[num_opps] = 0 # can't beat or tie the hero, whatever it is exactly
+            else:
+                strength = strengths[num_opps] = best_hand(opp_hand, board_info)
             if debug:
-                print(f'Result: {new_hand_btr}\nhand: {cards_as_str(hand)}\nopp: {cards_as_str(opp_hand)}')
-                print(f"Community:\n{cards_as_str(comm_cards)}\n")
-        ev.update(1 / len(best_hands) if best_hands[0] == hand else 0)
-    return ev
+                print(f'opp: {cards_as_str(opp_hand)} (' + (f'strength {strength})' if strength else 'ruled out)'))
+            if strength > hero:
+                num_looked_at = num_opps
+                break
+        if stats:
+            evaluated = perf_counter()
+        num_winners = 1
+        for num_opps in range(1, num_looked_at+1):
+            strength = strengths[num_opps]
+            if strength > hero:
+                for beaten_num_opps in range(max(num_opps, min_opps), max_opps+1):
+                    evs[beaten_num_opps].add_result(0)
+                break
+            num_winners += strength == hero
+            if num_opps >= min_opps:
+                evs[num_opps].add_result(num_winners)
+        if stats:
+            stats.record_trials(1, start, dealt, evaluated, perf_counter())
+            # Only the hero's category is counted, as the opps that are evaluated depend on it:
+            stats.count_strengths((hero,))
+    return evs
+
+def run_sim(hand_type: HandType, num_opps: int, debug: bool = False,
+            seed: Optional[int] = None, precision: Optional[float] = None,
+            max_trials: Optional[int] = None, rules: Optional[GameRules] = None,
+            board: Sequence[int] = (), sampling: str = 'independent') -> EV:
+    return run_sims(hand_type, num_opps, num_opps, debug, seed, precision, max_trials,
+                    rules=rules, board=board, sampling=sampling)[num_opps]
 
 def write_EVs_to_file(filename: str, evs: list[EV], trailing_msg: str = '') -> None:
     """Any existing contents in the file will be overwritten; `trailing_msg` will be added
@@ -232,6 +446,66 @@ def write_EVs_to_file(filename: str, evs: list[EV], trailing_msg: str = '') -> N
         for i, ev in enumerate(evs):
             f.write(f"#{i+1}: {str(ev)}{trailing_msg}\n")
 
+def write_results(results: list[EV], num_opps: int, board_str: str = '') -> None:
+    """Sorts `results` from best to worst, and writes them to a new file in a folder for today's date."""
+    filename = (datetime.today().strftime('%b %d %Y').replace(' 0', ' ') +
+                f"/preflop odds vs {num_opps} opps in {gametype().value}" +
+                (f" on {board_str}" if board_str else '') + f" - {round(time())}.txt")
+    results.sort(key=lambda ev: ev.ev(), reverse=True)
+    write_EVs_to_file(filename, results, f" vs {num_opps} opps")
+
+def simulator(engine: str) -> Callable[..., dict[int, EV]]:
+    """Returns the `run_sims` function for `engine` ('python' or 'numpy')."""
+    if engine == 'numpy':
+        import vectorized
+        return vectorized.run_sims
+    assert engine == 'python'
+    return run_sims
+
+def task_seed(base_seed: int, hand_type: Optional[HandType], trials_done: int = 0,
+              rules: Optional[GameRules] = None) -> int:
+    """Gives each hand type's simulation its own seed, which only depends on `base_seed`, the hand
+       type, and how many trials were already done for it by an earlier run (so it's the same no
+       matter which process runs the simulation, or in what order). With a `hand_type` of None, the
+       seed is shared by every hand type (for common random numbers)."""
+    key = f"{base_seed} {compare.game_rules(rules).gametype} {hand_type}" + (f" {trials_done}" if trials_done else '')
+    return random.Random(key).getrandbits(63)
+
+def _save_checkpoint(checkpoints: Checkpoints, hand_type: HandType, done: bool,
+                     evs: dict[int, EV]) -> None:
+    with instrumentation.phase('io'):
+        checkpoints.save(str(hand_type), {'done': done, 'evs': {k: ev.state() for k, ev in evs.items()}})
+
+def _load_checkpoint(checkpoints: Checkpoints, hand_type: HandType) -> tuple[bool, Optional[dict[int, EV]]]:
+    """Returns whether `hand_type`'s simulation finished, and its EVs so far (if any)."""
+    data = checkpoints.load(str(hand_type))
+    if data is None:
+        return False, None
+    return data['done'], {int(k): EV.from_state(hand_type, state) for k, state in data['evs'].items()}
+
+def _simulate_task(engine: str, rules: GameRules, hand_type: HandType, min_opps: int, max_opps: int,
+                   base_seed: int, precision: Optional[float], max_trials: Optional[int],
+                   initial_evs: Optional[dict[int, EV]], checkpoints: Checkpoints, board: Sequence[int] = (),
+                   sampling: str = 'independent'
+                   ) -> tuple[dict[int, EV], Optional[instrumentation.Instrumentation]]:
+    """Simulates one hand type of the sweep in `main` (possibly in a worker process, which needn't
+       have set a gametype, as `rules` are passed along), checkpointing its progress. Also returns the
+       stats collected for it, if instrumentation is enabled. Unless `sampling` is 'independent',
+       every hand type is dealt from the same seed, to face the same scenarios."""
+    trials_done = initial_evs[max_opps].hands_played if initial_evs else 0
+    seed = task_seed(base_seed, hand_type if sampling == 'independent' else None, trials_done, rules)
+    # Only the python engine has other sampling modes:
+    sampling_kwargs = {} if sampling == 'independent' else {'sampling': sampling}
+    evs = simulator(engine)(hand_type, min_opps, max_opps, seed=seed, precision=precision,
+                            max_trials=max_trials, initial_evs=initial_evs,
+                            on_progress=partial(_save_checkpoint, checkpoints, hand_type, False),
+                            rules=rules, board=board, **sampling_kwargs)
+    return evs, (stats.take() if (stats := instrumentation.active()) else None)
+
+def _init_worker(instrument: bool) -> None:
+    if instrument:
+        instrumentation.enable()
+
 def main() -> None:
     Utils.pypy_notice()
     chosen_gametype = (GameType.SHORTDECK if 'shortdeck' in sys.argv else
@@ -239,7 +513,35 @@ def main() -> None:
                        GameType.OMAHA if 'omaha' in sys.argv else
                        GameType.TEXAS)
     compare.set_gametype(chosen_gametype)
-    preflop_types = HandType4Cards.all_hand_types() if gametype() == GameType.OMAHA else HandType2Cards.all_hand_types()
+    rules = compare.game_rules()
+    engine = Utils.flag_value('--engine', 'python')
+    workers = int(Utils.flag_value('--workers', '1'))
+    precision = float(p) if (p := Utils.flag_value('--precision')) else None
+    max_trials = int(t) if (t := Utils.flag_value('--max-trials')) else None
+    sampling = Utils.flag_value('--sampling', 'independent')
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"--sampling must be one of {', '.join(SAMPLING_MODES)}")
+    if sampling != 'independent' and engine != 'python':
+        raise ValueError(f"Only the python engine has --sampling {sampling}")
+    preflop_types: list[HandType] = []
+    if not rules.omaha:
+        preflop_types.extend(HandType2Cards.all_hand_types(rules))
+    elif '--suit-classes' in sys.argv:
+        preflop_types.extend(OmahaSuitType.all_hand_types())
+    else:
+        preflop_types.extend(HandType4Cards.all_hand_types(rules))
+    board_str = Utils.flag_value('--board', '')
+    board = evaluator.encode_cards(board_str)
+    if len(board) > 5 or len(set(board)) < len(board) or not set(board) <= set(rules.deck):
+        raise ValueError(f"{board_str} isn't a board in {rules.gametype.value}")
+    if board:
+        if '--store' in sys.argv:
+            raise ValueError("The results store only holds preflop results, which `--board` changes")
+        if sampling == 'stratified':
+            raise ValueError("Boards can't be stratified by texture when some of the board is known")
+        # Skipping the hand types that the board blocks entirely:
+        preflop_types = [hand_type for hand_type in preflop_types
+                         if any(not set(board).intersection(hand) for hand in hand_type.concrete_hands())]
     # todo - make it so that the user can do something like x/y, where x and y are integers up to them.
     # will compute that fraction of the preflop_types
     rough_halfway_idx = len(preflop_types) // 2
@@ -255,16 +557,85 @@ def main() -> None:
         preflop_types = preflop_types[rough_three_quarter_idx:]
 
     min_opps, max_opps = int((my_split := sys.argv[1].split('-'))[0]), int(my_split[-1])
-    for num_opps in range(min_opps, max_opps+1):
-        results: list[EV] = []
-        filename = (datetime.today().strftime('%b %d %Y').replace(' 0', ' ') +
-                    f"/preflop odds vs {num_opps} opps in {gametype().value} - {round(time())}.txt")
-        for i, hand_type in enumerate(preflop_types): # type: ignore
-            print(f'Ran simulations for {i} out of {len(preflop_types)} starting hand types') # type: ignore
-            print(f"Running simulation for {hand_type} vs {num_opps} opps")
-            results.append(run_sim(hand_type, num_opps))
-            results.sort(key=lambda ev: ev.ev(), reverse=True)
-        write_EVs_to_file(filename, results, f" vs {num_opps} opps")
+    checkpoints = Checkpoints(f"checkpoints/{gametype().value} vs {min_opps}-{max_opps} opps" +
+                              (' by suit classes' if '--suit-classes' in sys.argv else '') +
+                              (f" on {board_str}" if board_str else '') +
+                              (f" ({sampling} sampling)" if sampling != 'independent' else ''))
+    # Slices of a sweep (e.g. `/` and `//`, run at the same time) share the folder, so it's only an
+    # error if this slice's own hand types have checkpoints:
+    if '--resume' not in sys.argv and any(checkpoints.has(str(hand_type)) for hand_type in preflop_types):
+        raise FileExistsError(f"There are checkpoints in `{checkpoints.folder}` for these hand types: "
+                              f"pass `--resume` to continue that sweep, or delete the folder")
+    meta = checkpoints.save_if_missing('meta', {
+        'base_seed': int(Utils.flag_value('--seed', str(random.randrange(2**32)))),
+        'sweep_id': uuid.uuid4().hex, # so that resuming after adding to the store doesn't add again
+    })
+    base_seed = meta['base_seed']
+    print(f"Using a base seed of {base_seed} (pass `--seed {base_seed}` to reproduce this run)")
+
+    results_by_opps: dict[int, list[EV]] = {num_opps: [] for num_opps in range(min_opps, max_opps+1)}
+    def record(hand_type: HandType, evs: dict[int, EV]) -> None:
+        _save_checkpoint(checkpoints, hand_type, True, evs)
+        for num_opps, ev in evs.items():
+            results_by_opps[num_opps].append(ev)
+
+    pending: list[tuple[HandType, Optional[dict[int, EV]]]] = []
+    for hand_type in preflop_types:
+        done, evs = _load_checkpoint(checkpoints, hand_type)
+        if done:
+            assert evs is not None
+            record(hand_type, evs)
+        else:
+            pending.append((hand_type, evs))
+    if len(pending) < len(preflop_types):
+        print(f"Resuming: {len(preflop_types) - len(pending)} hand types were already finished")
+    stats = instrumentation.enable() if '--stats' in sys.argv else None
+    if stats:
+        stats.tasks_total = len(pending)
+    def finish_task(hand_type: HandType, evs: dict[int, EV],
+                    task_stats: Optional[instrumentation.Instrumentation]) -> None:
+        record(hand_type, evs)
+        if stats and task_stats:
+            stats.merge(task_stats)
+            stats.task_done()
+
+    if workers <= 1:
+        for i, (hand_type, initial_evs) in enumerate(pending):
+            print(f'Ran simulations for {i} out of {len(pending)} starting hand types')
+            print(f"Running simulation for {hand_type} vs {min_opps}-{max_opps} opps")
+            finish_task(hand_type, *_simulate_task(engine, rules, hand_type, min_opps, max_opps,
+                                                   base_seed, precision, max_trials, initial_evs,
+                                                   checkpoints, board, sampling))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(stats is not None,)) as executor:
+            futures = {executor.submit(_simulate_task, engine, rules, hand_type, min_opps, max_opps,
+                                       base_seed, precision, max_trials, initial_evs, checkpoints,
+                                       board, sampling): hand_type
+                       for hand_type, initial_evs in pending}
+            for i, future in enumerate(as_completed(futures)):
+                evs, task_stats = future.result()
+                print(f"Finished {i+1} out of {len(futures)} simulations: {evs[max_opps]} vs {max_opps} opps")
+                finish_task(futures[future], evs, task_stats)
+    with instrumentation.phase('io'):
+        for num_opps, results in results_by_opps.items():
+            write_results(results, num_opps, board_str)
+        if store_path := Utils.flag_value('--store'):
+            from results_store import ResultsStore
+            store = ResultsStore(store_path)
+            num_skipped = store.add(gametype(), results_by_opps, meta.get('sweep_id'))
+            store.close()
+            print(f"Added the results to the totals in {store_path}" +
+                  (f" ({num_skipped} hand types were already added before this run resumed)"
+                   if num_skipped else ''))
+    if stats:
+        report_path = Utils.flag_value('--stats')
+        assert report_path is not None
+        Utils.write_atomically(report_path, json.dumps(stats.report(), indent=2))
+        print(f"Wrote the stats to {report_path}")
+    for hand_type in preflop_types:
+        checkpoints.remove(str(hand_type))
+    checkpoints.remove_folder_if_unused('meta')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""A precomputed matrix of the exact heads up equity of every `HandType2Cards` class against every
+other, for texas holdem and the shortdeck gametypes.
+
+Building the matrix enumerates every concrete matchup on every board, with each class of
+suit-isomorphic boards evaluated only once (as the classes of hands are closed under swapping suits,
+so are the totals for each pair of classes). This needs NumPy, and takes minutes for texas holdem.
+Looking up an equity only needs the standard library: the file is memory-mapped, and each lookup
+reads one value.
+
+Usage: `python preflop_matrix.py build [shortdeck|shortdeck_v] [--workers N]`, and then
+`python preflop_matrix.py <class> <class> [shortdeck|shortdeck_v]` (e.g. `AKs QQ`)."""
+
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from math import comb, factorial, prod
+from time import time
+from typing import Iterator, Mapping
+import mmap
+import os
+import struct
+import sys
+
+import compare
+from compare import GameType, gametype, num_card_vals
+import evaluator
+from main import HandType2Cards
+import Utils
+
+MAGIC = b'HUM1'
+
+def matrix_path(chosen_gametype: GameType) -> str:
+    return f"matrices/{chosen_gametype.name.lower()} heads up.bin"
+
+def _masks_with_popcount(num_vals: int, popcount: int) -> list[int]:
+    return [sum(1 << v for v in vals) for vals in combinations(range(num_vals), popcount)]
+
+def canonical_boards(num_vals: int) -> Iterator[tuple[tuple[int, ...], int]]:
+    """Yields one 5 card board from each class of boards that are the same up to swapping suits, along
+       with the size of the class, for a deck of the top `num_vals` vals. A board's class is given by
+       the multiset of its suits' val masks, so each class is generated once, as a non-increasing
+       tuple of masks (assigned to the suits in order)."""
+    lowest_val = len(evaluator.VALS) - num_vals
+    masks_by_size = [_masks_with_popcount(num_vals, k) for k in range(6)]
+    def suit_masks(num_suits: int, cards_left: int, max_mask: tuple[int, int]) -> Iterator[tuple[int, ...]]:
+        if num_suits == 0:
+            if cards_left == 0:
+                yield ()
+            return
+        for size in range(min(cards_left, max_mask[0]), -1, -1):
+            for mask in masks_by_size[size]:
+                if (size, mask) <= max_mask:
+                    for rest in suit_masks(num_suits - 1, cards_left - size, (size, mask)):
+                        yield (mask,) + rest
+    for masks in suit_masks(len(evaluator.SUITS), 5, (5, 1 << num_vals)):
+        board = tuple(sorted(((lowest_val + v) * 4 + suit for suit, mask in enumerate(masks)
+                              for v in range(num_vals) if mask >> v & 1), reverse=True))
+        num_suit_assignments = factorial(len(masks)) // prod(factorial(masks.count(m)) for m in set(masks))
+        yield board, num_suit_assignments
+
+class _Builder:
+    """Accumulates, for each pair of classes, the pots won by the first class's hands (in half pots)
+       and the number of matchups, over every hand of the first class against every compatible hand
+       of the second, on each board."""
+    def __init__(self) -> None:
+        import numpy as np
+        self.hand_types = HandType2Cards.all_hand_types()
+        hands, classes = [], []
+        for i, hand_type in enumerate(self.hand_types):
+            hands.extend(hand_type.concrete_hands())
+            classes.extend([i] * hand_type.num_combos())
+        n = len(self.hand_types)
+        self.hands = np.array(hands, dtype=np.int64)
+        self.classes = np.array(classes, dtype=np.int64)
+        self.masks = (np.int64(1) << self.hands[:, 0]) | (np.int64(1) << self.hands[:, 1])
+        # The pairs of distinct hands that share a card, each pair once:
+        by_card: dict[int, list[int]] = {}
+        for i, hand in enumerate(hands):
+            for card in hand:
+                by_card.setdefault(card, []).append(i)
+        pairs = np.array([(i, j) for i, hand in enumerate(hands) for card in hand
+                          for j in by_card[card] if j > i], dtype=np.int64)
+        self.firsts, self.seconds = pairs[:, 0], pairs[:, 1]
+        self.pair_cells = self.classes[self.firsts] * n + self.classes[self.seconds]
+        self.half_pots = np.zeros((n, n), dtype=np.float64)
+        self.matchups = np.zeros((n, n), dtype=np.float64)
+
+    def add_board(self, board: tuple[int, ...], weight: int) -> None:
+        import numpy as np
+        import vectorized
+        n = len(self.hand_types)
+        board_mask = sum(1 << card for card in board)
+        alive = (self.masks & board_mask) == 0
+        num_alive = int(alive.sum())
+        strengths = np.full(len(self.hands), -1, dtype=np.int64)
+        strengths[alive] = vectorized.evaluate([self.hands[alive]],
+                                               np.broadcast_to(np.array(board), (num_alive, 5)))[:, 0]
+        # Counting every pair of hands first (including each hand with itself, and pairs that share a
+        # card), by the number of hands of each class with each strength:
+        _, strength_index = np.unique(strengths[alive], return_inverse=True)
+        counts = np.bincount(strength_index * n + self.classes[alive],
+                             minlength=(strength_index.max() + 1) * n).reshape(-1, n).astype(np.float64)
+        weaker = np.cumsum(counts, axis=0) - counts
+        half_pots = counts.T @ (2 * weaker + counts)
+        per_class = counts.sum(axis=0)
+        matchups = np.outer(per_class, per_class)
+        # ...then taking out each hand against itself (a tie), and the pairs that share a card:
+        half_pots[np.diag_indices(n)] -= per_class
+        matchups[np.diag_indices(n)] -= per_class
+        both_alive = alive[self.firsts] & alive[self.seconds]
+        first_strengths = strengths[self.firsts[both_alive]]
+        second_strengths = strengths[self.seconds[both_alive]]
+        first_half_pots = 2 * (first_strengths > second_strengths) + (first_strengths == second_strengths)
+        # Pairs in the reverse order have the reverse outcomes, so only one order needs counting:
+        outcomes = np.bincount(self.pair_cells[both_alive] * 3 + first_half_pots,
+                               minlength=3 * n * n).reshape(n, n, 3)
+        pair_half_pots, pair_counts = outcomes[:, :, 1] + 2 * outcomes[:, :, 2], outcomes.sum(axis=2)
+        half_pots -= pair_half_pots + (2 * pair_counts - pair_half_pots).T
+        matchups -= pair_counts + pair_counts.T
+        self.half_pots += weight * half_pots
+        self.matchups += weight * matchups
+
+    def write(self, filepath: str) -> None:
+        import numpy as np
+        num_boards = comb(4 * num_card_vals() - 4, 5)
+        equities = np.divide(self.half_pots, 2 * self.matchups, out=np.zeros_like(self.half_pots),
+                             where=self.matchups > 0)
+        header = ' '.join(str(hand_type) for hand_type in self.hand_types).encode()
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wb') as f:
+            f.write(MAGIC + struct.pack('<H', len(header)) + header)
+            f.write(equities.astype('<f4').tobytes())
+            f.write(np.rint(self.matchups / num_boards).astype(np.uint8).tobytes())
+
+def _build_part(boards: list[tuple[tuple[int, ...], int]]) -> _Builder:
+    """Returns a builder that's added up `boards` (it can be pickled, to return it from a worker)."""
+    builder = _Builder()
+    start = time()
+    for i, (board, weight) in enumerate(boards):
+        builder.add_board(board, weight)
+        if i % 10000 == 0 and i > 0:
+            print(f"{i} out of {len(boards)} boards processed in {round(time() - start)}s")
+    return builder
+
+def build(filepath: str, workers: int = 1) -> None:
+    """Builds the matrix for the current gametype, splitting the boards between `workers` processes."""
+    assert gametype() != GameType.OMAHA, "The matrix is only for hand types of 2 cards"
+    boards = list(canonical_boards(num_card_vals()))
+    if workers <= 1:
+        builder = _build_part(boards)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=compare.set_gametype,
+                                 initargs=(gametype(),)) as executor:
+            parts = list(executor.map(_build_part, [boards[i::workers] for i in range(workers)]))
+        builder = parts[0]
+        for part in parts[1:]:
+            builder.half_pots += part.half_pots
+            builder.matchups += part.matchups
+    builder.write(filepath)
+
+class EquityMatrix:
+    """The heads up equities in a file written by `build`, looked up straight from a memory map."""
+    def __init__(self, filepath: str):
+        with open(filepath, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self._map[:len(MAGIC)] == MAGIC, f"{filepath} isn't an equity matrix file"
+        header_length, = struct.unpack_from('<H', self._map, len(MAGIC))
+        header_end = len(MAGIC) + 2 + header_length
+        names = self._map[len(MAGIC) + 2:header_end].decode().split()
+        self.index = {name: i for i, name in enumerate(names)}
+        self._equities_offset = header_end
+        self._matchups_offset = header_end + 4 * len(names) ** 2
+
+    def _cell(self, hand_type: HandType2Cards | str, other: HandType2Cards | str) -> int:
+        return self.index[str(hand_type)] * len(self.index) + self.index[str(other)]
+
+    def equity(self, hand_type: HandType2Cards | str, other: HandType2Cards | str) -> float:
+        """The share of the pot that `hand_type` wins against `other` on average (from 0 to 1)."""
+        return struct.unpack_from('<f', self._map, self._equities_offset + 4 * self._cell(hand_type, other))[0]
+
+    def num_matchups(self, hand_type: HandType2Cards | str, other: HandType2Cards | str) -> int:
+        """The number of pairs of concrete hands of the classes that don't share a card."""
+        return self._map[self._matchups_offset + self._cell(hand_type, other)]
+
+    def range_equity(self, hero: Mapping[HandType2Cards | str, float],
+                     villain: Mapping[HandType2Cards | str, float]) -> float:
+        """The share of the pot that the `hero` range wins against the `villain` range on average,
+           where each range maps classes to weights. This is exact, as each pair of classes is
+           weighed by its number of matchups."""
+        won, total = 0.0, 0.0
+        for hand_type, weight in hero.items():
+            for other, other_weight in villain.items():
+                matchups = weight * other_weight * self.num_matchups(hand_type, other)
+                won += matchups * self.equity(hand_type, other)
+                total += matchups
+        return won / total
+
+    def close(self) -> None:
+        self._map.close()
+
+def main() -> None:
+    compare.set_gametype(GameType.SHORTDECK if 'shortdeck' in sys.argv else
+                         GameType.SHORTDECK_TRIPS if 'shortdeck_v' in sys.argv else
+                         GameType.TEXAS)
+    if sys.argv[1] == 'build':
+        build(matrix_path(gametype()), int(Utils.flag_value('--workers', '1')))
+        print(f"Wrote {matrix_path(gametype())}")
+        return
+    matrix = EquityMatrix(matrix_path(gametype()))
+    print(f"{sys.argv[1]} wins {round(matrix.equity(sys.argv[1], sys.argv[2]) * 100, 3)}% of the pot "
+          f"on avg vs {sys.argv[2]}")
+    matrix.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Equity of hands and ranges against each other, for any gametype.
+
+A `Range` is a weighted set of concrete hands, given by hand types (e.g. `HandType2Cards` or
+`OmahaSuitType`) and/or concrete hands such as 'AsKd' (a single hand is just a range of one).
+`equity` enumerates every deal exactly when there are few enough of them, and otherwise runs Monte
+Carlo trials."""
+
+from __future__ import annotations
+from bisect import bisect
+from fractions import Fraction
+from itertools import accumulate, chain, combinations, count
+from math import comb, gcd, lcm, prod
+from typing import Iterable, Optional, Sequence
+import random
+
+import compare
+from compare import num_card_vals, num_hole_cards
+from dealer import Dealer
+import evaluator
+from main import EV, HandType, PRECISION_CHECK_INTERVAL, trials_limit, precise_enough
+
+HandSpec = HandType | str
+"""A hand type, or a concrete hand such as 'AsKd'."""
+
+EXACT_LIMIT = 2_000_000
+"""By default, `equity` enumerates exactly when the number of boards times the number of matchups
+   of the ranges' hands is at most this."""
+MAX_REJECTIONS = 10000
+"""How many conflicting deals in a row `equity` tries before deciding the ranges can't be dealt."""
+
+def card_mask(cards: Iterable[int]) -> int:
+    return sum(1 << card for card in set(cards))
+
+class Range:
+    def __init__(self, hands: Iterable[HandSpec] | dict[HandSpec, float]):
+        """`hands` can map each hand type or concrete hand to a weight (by default, 1). Hand types are
+           expanded into their concrete hands once, here; a hand given more than once keeps the
+           last weight it's given."""
+        weights: dict[tuple[int, ...], float] = {}
+        items = hands.items() if isinstance(hands, dict) else ((spec, 1.0) for spec in hands)
+        lowest_card = 4 * (len(evaluator.VALS) - num_card_vals())
+        for spec, weight in items:
+            for hand in ([tuple(sorted(evaluator.encode_cards(spec), reverse=True))]
+                         if isinstance(spec, str) else spec.concrete_hands()):
+                assert len(set(hand)) == len(hand) == num_hole_cards() and min(hand) >= lowest_card, \
+                    f"{spec} isn't a hand in {compare.gametype().value}"
+                weights[hand] = weight
+        self.hands = [hand for hand, weight in weights.items() if weight > 0]
+        self.weights = [weights[hand] for hand in self.hands]
+        self.masks = [card_mask(hand) for hand in self.hands]
+        self._cumulative_weights = list(accumulate(self.weights))
+
+    def __len__(self) -> int:
+        return len(self.hands)
+
+    def sample(self, rng: random.Random) -> int:
+        """Returns the index of a hand, picked with a probability proportional to its weight."""
+        return min(bisect(self._cumulative_weights, rng.random() * self._cumulative_weights[-1]),
+                   len(self.hands) - 1)
+
+def equity(ranges: Sequence[Range], board: Sequence[int] = (), dead: Sequence[int] = (),
+           exact: Optional[bool] = None, seed: Optional[int] = None, precision: Optional[float] = None,
+           max_trials: Optional[int] = None, initial_evs: Optional[list[EV]] = None) -> list[EV]:
+    """Returns the EV of each range against all the others. `board` holds the known community cards
+       (if any), and `dead` holds cards that can't be dealt to anyone.
+
+       If `exact` is None, every deal is enumerated if there are few enough (see `EXACT_LIMIT`).
+       An exact EV counts each deal as many times as the product of its hands' weights (see
+       `whole_weights`), so its wins, splits, losses and `hands_played` are counts of deals, and it
+       has no confidence interval. Otherwise, hands are sampled in proportion to their weights, and
+       `seed`, `precision`, `max_trials` and `initial_evs` (the EVs of an earlier sampled run, to
+       continue from) work as in `main.run_sims`."""
+    known = card_mask(board) | card_mask(dead)
+    deck = [card for card in range(4 * (len(evaluator.VALS) - num_card_vals()), 52)
+            if not known >> card & 1]
+    # Hands blocked by the known cards are dropped once, rather than for every board:
+    alive = [[i for i, mask in enumerate(r.masks) if not mask & known] for r in ranges]
+    assert all(alive), "A range has no hands left after removing those blocked by the known cards"
+    num_boards = comb(len(deck), 5 - len(board))
+    if initial_evs:
+        assert not exact, "Only a sampled run can be continued"
+        exact = False
+    elif exact is None:
+        exact = num_boards * prod(len(hands) for hands in alive) <= EXACT_LIMIT
+    evs = initial_evs or [EV(exact=exact) for _ in ranges]
+    if exact:
+        _enumerate(ranges, alive, tuple(board), deck, evs)
+    else:
+        _simulate(ranges, tuple(board), known, deck, evs, random.Random(seed), precision, max_trials)
+    return evs
+
+def whole_weights(weights: Sequence[float]) -> list[int]:
+    """The smallest whole numbers in the same ratios as `weights` (up to rounding the weights to
+       fractions with denominators of at most a million), e.g. [1, 1] for [0.5, 0.5]."""
+    fractions = [Fraction(weight).limit_denominator(10**6) for weight in weights]
+    scale = lcm(*(fraction.denominator for fraction in fractions))
+    counts = [int(fraction * scale) for fraction in fractions]
+    divisor = gcd(*counts)
+    return [count // divisor for count in counts]
+
+def _enumerate(ranges: Sequence[Range], alive: list[list[int]], board: tuple[int, ...],
+               deck: list[int], evs: list[EV]) -> None:
+    ev_ = compare.evaluator()
+    counts = [whole_weights(r.weights) for r in ranges]
+    for rest in combinations(deck, 5 - len(board)):
+        rest_mask = card_mask(rest)
+        board_info = ev_.prepare_board(board + rest)
+        # Each hand is evaluated once per board, and then reused in every matchup it's in:
+        players = [[(r.masks[i], hand_counts[i], ev_.best_hand(r.hands[i], board_info))
+                    for i in hands if not r.masks[i] & rest_mask]
+                   for r, hand_counts, hands in zip(ranges, counts, alive)]
+        _add_matchups(players, evs, 0, 1, [])
+
+def _add_matchups(players: list[list[tuple[int, int, int]]], evs: list[EV], used_mask: int,
+                  times: int, strengths: list[int]) -> None:
+    """Adds the results of every matchup of the remaining players' hands that don't share cards,
+       each counted `times` times the product of its hands' counts."""
+    if len(strengths) == len(players):
+        best = max(strengths)
+        num_winners = strengths.count(best)
+        for ev, strength in zip(evs, strengths):
+            ev.add_result(num_winners if strength == best else 0, times)
+        return
+    for mask, hand_count, strength in players[len(strengths)]:
+        if not mask & used_mask:
+            strengths.append(strength)
+            _add_matchups(players, evs, used_mask | mask, times * hand_count, strengths)
+            strengths.pop()
+
+def _simulate(ranges: Sequence[Range], board: tuple[int, ...], known: int, deck: list[int],
+              evs: list[EV], rng: random.Random, precision: Optional[float],
+              max_trials: Optional[int]) -> None:
+    num_trials = trials_limit(precision, max_trials)
+    dealer = Dealer(deck, rng)
+    num_rest = 5 - len(board)
+    for i in count(evs[0].hands_played):
+        if ((num_trials is not None and i >= num_trials) or
+            (i % PRECISION_CHECK_INTERVAL == 0 and precise_enough(dict(enumerate(evs)), precision))):
+            break
+        # Rejecting whole deals with conflicting cards keeps each deal's probability proportional to
+        # the product of its hands' weights:
+        for _ in range(MAX_REJECTIONS):
+            picks = [r.sample(rng) for r in ranges]
+            hands_mask = 0
+            for r, pick in zip(ranges, picks):
+                if r.masks[pick] & (hands_mask | known):
+                    break
+                hands_mask |= r.masks[pick]
+            else:
+                break
+        else:
+            raise ValueError("The ranges can't be dealt without conflicting cards")
+        hands = [r.hands[pick] for r, pick in zip(ranges, picks)]
+        rest = dealer.deal(chain.from_iterable(hands), num_rest)
+        strengths = compare.strengths(hands, board + tuple(rest[:num_rest]))
+        best = max(strengths)
+        num_winners = strengths.count(best)
+        for ev, strength in zip(evs, strengths):
+            ev.add_result(num_winners if strength == best else 0)
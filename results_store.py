@@ -0,0 +1,178 @@
+"""A persistent SQLite store of simulation results, so that precision can be refined over many runs.
+
+Results are keyed by gametype, hand type and number of opps, and hold the totals of an `EV`: adding
+new results to the store adds to these totals rather than replacing them. (So the new results should
+come from independent trials, e.g. not from a rerun with the same `--seed`.)
+
+Usage: `python results_store.py <db file> export <gametype> <num opps> [suit_classes]`, where the
+gametype is one of the words `main.py` takes (texas, shortdeck, shortdeck_v, omaha)."""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime
+from time import time
+from typing import Iterable, Optional
+import sqlite3
+import json
+import math
+import re
+import sys
+
+from compare import GameType
+from main import EV, NamedHandType, OmahaSuitType, write_EVs_to_file
+
+@dataclass(frozen=True)
+class StoredHandType:
+    """Stands in for the hand type of an `EV` read from the store."""
+    name: str
+    combos: int
+
+    def num_combos(self) -> int:
+        return self.combos
+
+    def __str__(self) -> str:
+        return self.name
+
+def hand_class(hand_type: NamedHandType) -> str:
+    """Omaha results by `OmahaSuitType` are kept apart from those by `HandType4Cards`, since a
+       monosuited class can have the same name as a rank class."""
+    return 'suit classes' if isinstance(hand_type, OmahaSuitType) else 'vals'
+
+_RESULTS_LINE = re.compile(r'(?:#\d+: )?(\S+) wins (\S+)% of the pot on avg'
+                           r'(?: \(±(\S+)% at 95% confidence, (\d+) hands, (\d+) combos'
+                           r'(?:; (\d+) wins, \d+ splits(?: \(([^)]*)\))?, (\d+) losses)?\))? vs (\d+) opps')
+_SPLITS = re.compile(r'(\d+)-way: (\d+)')
+
+@dataclass
+class ResultsLine:
+    """A parsed line of a results file. Lines from before the number of hands was written have no `ev`,
+       and those from before the wins, splits and losses were written have an `ev` without them."""
+    hand_type: str
+    num_opps: int
+    equity: float
+    ev: Optional[EV]
+
+def parse_results_line(line: str) -> ResultsLine:
+    match = _RESULTS_LINE.fullmatch(line.strip())
+    assert match is not None, f"Not a results line: {line!r}"
+    hand_type, equity, interval, hands_played, combos, wins, splits, losses, num_opps = match.groups()
+    ev = None
+    if wins is not None:
+        # The totals follow from the counts exactly:
+        ev = EV(StoredHandType(hand_type, int(combos)))
+        ev.add_result(1, int(wins))
+        for num_ways, count in _SPLITS.findall(splits or ''):
+            ev.add_result(int(num_ways), int(count))
+        ev.add_result(0, int(losses))
+    elif hands_played is not None:
+        # The sum of squares isn't written, but it can be recovered (up to rounding) from the
+        # confidence interval, by inverting `EV.confidence_interval`.
+        n, mean = int(hands_played), float(equity) / 100
+        variance = 0.0 if n < 2 or math.isinf(float(interval)) else (float(interval) / 196) ** 2 * n
+        ev = EV(StoredHandType(hand_type, int(combos)), mean * n, n,
+                n * mean ** 2 + variance * (n - 1))
+    return ResultsLine(hand_type, int(num_opps), float(equity), ev)
+
+_EV_COLUMNS = 'hand_type, num_combos, pots_won, hands_played, pots_won_squared, wins, losses, splits'
+
+class ResultsStore:
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS results (
+                                gametype TEXT NOT NULL, hand_class TEXT NOT NULL,
+                                hand_type TEXT NOT NULL, num_opps INTEGER NOT NULL,
+                                num_combos INTEGER NOT NULL, pots_won REAL NOT NULL,
+                                hands_played INTEGER NOT NULL, pots_won_squared REAL NOT NULL,
+                                wins INTEGER NOT NULL, losses INTEGER NOT NULL, splits TEXT NOT NULL,
+                                PRIMARY KEY (gametype, hand_class, num_opps, hand_type))''')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS added_sweeps (
+                                sweep_id TEXT NOT NULL, gametype TEXT NOT NULL, hand_class TEXT NOT NULL,
+                                hand_type TEXT NOT NULL,
+                                PRIMARY KEY (sweep_id, gametype, hand_class, hand_type))''')
+        self._db.commit()
+
+    def add(self, gametype: GameType, results_by_opps: dict[int, list[EV]],
+            sweep_id: Optional[str] = None) -> int:
+        """Merges a sweep's results into the totals, in one transaction. With a `sweep_id`, the hand
+           types that sweep already added are skipped (so a sweep that's resumed after adding its
+           results isn't counted twice), and the number of hand types skipped is returned."""
+        skipped: set[tuple[str, str]] = set()
+        with self._db:
+            if sweep_id is not None:
+                hand_types = {(hand_class(ev.hand_type), str(ev.hand_type))
+                              for evs in results_by_opps.values() for ev in evs if ev.hand_type is not None}
+                for hand_class_name, name in hand_types:
+                    added = (sweep_id, gametype.name, hand_class_name, name)
+                    if self._db.execute('SELECT 1 FROM added_sweeps WHERE sweep_id = ? AND gametype = ? '
+                                        'AND hand_class = ? AND hand_type = ?', added).fetchone():
+                        skipped.add((hand_class_name, name))
+                    else:
+                        self._db.execute('INSERT INTO added_sweeps VALUES (?, ?, ?, ?)', added)
+            for num_opps, evs in results_by_opps.items():
+                for ev in evs:
+                    assert ev.hand_type is not None
+                    name, hand_class_name = str(ev.hand_type), hand_class(ev.hand_type)
+                    if (hand_class_name, name) in skipped:
+                        continue
+                    stored = self.get(gametype, name, num_opps, hand_class_name)
+                    total = ev.merge(stored) if stored else ev
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (gametype.name, hand_class_name, name, num_opps, ev.hand_type.num_combos(),
+                         total.pots_won, total.hands_played, total.pots_won_squared, total.wins,
+                         total.losses, json.dumps(total.state()['splits']))
+                    )
+        return len(skipped)
+
+    def get(self, gametype: GameType, hand_type: str, num_opps: int,
+            hand_class_name: str = 'vals') -> Optional[EV]:
+        row = self._db.execute(
+            f'SELECT {_EV_COLUMNS} FROM results WHERE gametype = ? AND hand_class = ? AND '
+            f'num_opps = ? AND hand_type = ?', (gametype.name, hand_class_name, num_opps, hand_type)
+        ).fetchone()
+        return None if row is None else self._ev(row)
+
+    def results(self, gametype: GameType, num_opps: int, hand_class_name: str = 'vals') -> list[EV]:
+        """Returns every hand type's total EV against `num_opps` opps, from best to worst."""
+        rows = self._db.execute(
+            f'''SELECT {_EV_COLUMNS} FROM results WHERE gametype = ? AND hand_class = ? AND num_opps = ?
+                ORDER BY pots_won / hands_played DESC''',
+            (gametype.name, hand_class_name, num_opps)
+        )
+        return [self._ev(row) for row in rows]
+
+    def opp_counts(self, gametype: GameType, hand_class_name: str = 'vals') -> list[int]:
+        rows = self._db.execute('''SELECT DISTINCT num_opps FROM results WHERE gametype = ? AND
+                                   hand_class = ? ORDER BY num_opps''', (gametype.name, hand_class_name))
+        return [row[0] for row in rows]
+
+    def export(self, gametype: GameType, num_opps: int, hand_class_name: str = 'vals') -> str:
+        """Writes the totals to a text file in the format `main.py` writes, and returns its name."""
+        filename = (datetime.today().strftime('%b %d %Y').replace(' 0', ' ') +
+                    f"/stored preflop odds vs {num_opps} opps in {gametype.value} - {round(time())}.txt")
+        write_EVs_to_file(filename, self.results(gametype, num_opps, hand_class_name), f" vs {num_opps} opps")
+        return filename
+
+    def close(self) -> None:
+        self._db.close()
+
+    @staticmethod
+    def _ev(row: Iterable) -> EV:
+        name, combos, pots_won, hands_played, pots_won_squared, wins, losses, splits = row
+        return EV.from_state(StoredHandType(name, combos),
+                             {'pots_won': pots_won, 'hands_played': hands_played,
+                              'pots_won_squared': pots_won_squared, 'wins': wins, 'losses': losses,
+                              'splits': json.loads(splits)})
+
+def main() -> None:
+    db_path, command = sys.argv[1:3]
+    assert command == 'export'
+    gametype = {'texas': GameType.TEXAS, 'shortdeck': GameType.SHORTDECK,
+                'shortdeck_v': GameType.SHORTDECK_TRIPS, 'omaha': GameType.OMAHA}[sys.argv[3]]
+    hand_class_name = 'suit classes' if 'suit_classes' in sys.argv[5:] else 'vals'
+    store = ResultsStore(db_path)
+    print(f"Wrote {store.export(gametype, int(sys.argv[4]), hand_class_name)}")
+    store.close()
+
+if __name__ == '__main__':
+    main()
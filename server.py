@@ -0,0 +1,303 @@
+"""A long-lived local server for equity queries, so that tools asking many small questions don't pay
+for starting Python, building the evaluator's tables and warming up PyPy's JIT on every one. The
+queries run on a pool of worker processes that stay up (and keep their tables) between queries.
+
+Usage: `python server.py [--port N | --socket <path>] [--workers N] [--cache-size N]`
+
+Queries are JSON objects, one per line, sent over a local TCP connection (127.0.0.1, port 8765 by
+default) or a Unix socket. The queries on a connection are answered concurrently, so each reply
+echoes its query's `id` (if it has one). There are two kinds of queries:
+- `{"query": "preflop", "gametype": "texas", "hand": "AKs", "opps": 3}` gives a hand type's EV vs
+  `opps` random hands. `hand` is a class such as `AKs`, `QQ`, `AAKK`, or `AK.AK` for an Omaha suit
+  class, and `engine` can be 'python' (the default) or 'numpy'. A known flop or turn can be given
+  as the `board`.
+- `{"query": "equity", "gametype": "omaha", "hands": ["AsAhKsKh", "QdQcJdJc"]}` gives the EV of each
+  hand (concrete, or a class) against the others, optionally with a `board` and `dead` cards (e.g.
+  "Ks7d2c"), and `exact` as in `ranges.equity`.
+The gametype is one of 'texas', 'shortdeck', 'shortdeck_v' and 'omaha', and both kinds of queries
+take the optional `precision`, `max_trials` and `seed` of `main.run_sims`.
+
+A preflop query, or an equity query whose deals are sampled, gets a `progress` reply after each chunk
+of trials, and every query ends with a `result` reply (or an `error` one). Results are kept in an LRU
+cache keyed by the whole query (other than its id), and a query that's asked again while it's still
+running shares the running job (and its progress replies)."""
+
+from __future__ import annotations
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Hashable, Optional
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+
+import compare
+from compare import GameRules, GameType
+import evaluator
+from main import (EV, SUITS, HandType, HandType2Cards, HandType4Cards, OmahaSuitType, card_val_key,
+                  precise_enough, simulator, task_seed, trials_limit)
+import ranges
+import Utils
+
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_SIZE = 10000
+CHUNK_TRIALS = 20000
+"""How many trials of a preflop or sampled equity query are run as one job on the pool, between
+   progress replies."""
+
+GAMETYPES = {'texas': GameType.TEXAS, 'shortdeck': GameType.SHORTDECK,
+             'shortdeck_v': GameType.SHORTDECK_TRIPS, 'omaha': GameType.OMAHA}
+
+Send = Callable[[dict], Awaitable[None]]
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the value for `key` (marking it as the most recently used), or None."""
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        self._items.pop(key, None)
+
+def parse_hand_type(name: str, rules: GameRules) -> HandType:
+    """Parses a class such as 'AKs', 'AKo', 'QQ', 'AAKK' or (for Omaha suit classes) 'AK.AK'."""
+    vals = name.replace('.', '') if rules.omaha else name[:2]
+    if len(vals) != rules.num_hole_cards or any(val not in rules.card_vals for val in vals):
+        raise ValueError(f"{name} isn't a hand type in {rules.gametype.value}")
+    if rules.omaha:
+        if '.' not in name:
+            val1, val2, val3, val4 = sorted(name, key=card_val_key)
+            return HandType4Cards((val1, val2, val3, val4))
+        hand_type = OmahaSuitType(*name.split('.'))
+        if not hand_type.well_formed():
+            raise ValueError(f"{name} isn't a valid suit class")
+        return hand_type
+    high, low = sorted(vals, key=card_val_key)
+    if name[2:] not in (('',) if high == low else ('s', 'o')):
+        raise ValueError(f"{name} isn't a hand type in {rules.gametype.value}")
+    return HandType2Cards(high, low, name[2:] == 's')
+
+def _hand_spec(name: str, rules: GameRules) -> ranges.HandSpec:
+    """A concrete hand (such as 'AsKd') stays a str, and anything else is parsed as a hand type."""
+    if len(name) == 2 * rules.num_hole_cards and all(suit in SUITS for suit in name[1::2]):
+        return name
+    return parse_hand_type(name, rules)
+
+def _field(query: dict, name: str, field_type: type | tuple[type, ...], default: Any = None) -> Any:
+    """Returns `query[name]` (or `default` if it's missing or null), raising a TypeError if it isn't a
+       `field_type` (JSON's true and false only count as bools, not as numbers)."""
+    value = query.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, field_type) or (isinstance(value, bool) and field_type is not bool):
+        raise TypeError(f"`{name}` can't be {json.dumps(value)}")
+    return value
+
+def _ev_fields(ev: EV) -> dict:
+    ci = ev.confidence_interval()
+    return {'ev': ev.ev(), 'ci': None if ev.exact or ci == float('inf') else ci,
+            'hands_played': ev.hands_played, 'wins': ev.wins, 'splits': ev.splits, 'losses': ev.losses}
+
+def _preflop_chunk(engine: str, rules: GameRules, hand_type: HandType, num_opps: int, board: str,
+                   seed: int, precision: Optional[float], max_trials: int,
+                   initial_evs: dict[int, EV]) -> dict[int, EV]:
+    return simulator(engine)(hand_type, num_opps, num_opps, seed=seed, precision=precision,
+                             max_trials=max_trials, initial_evs=initial_evs, rules=rules,
+                             board=evaluator.encode_cards(board))
+
+def _equity_chunk(chosen_gametype: GameType, hands: list[ranges.HandSpec], board: str, dead: str,
+                  exact: Optional[bool], seed: int, precision: Optional[float], max_trials: int,
+                  initial_evs: Optional[list[EV]]) -> list[EV]:
+    compare.set_gametype(chosen_gametype) # ranges.py works on the current gametype
+    return ranges.equity([ranges.Range([hand]) for hand in hands], evaluator.encode_cards(board),
+                         evaluator.encode_cards(dead), exact, seed, precision, max_trials, initial_evs)
+
+def worker_pool(workers: int) -> ProcessPoolExecutor:
+    """The workers are spawned rather than forked: the pool starts them on demand, and a forked worker
+       would inherit the sockets of the connections open at the time (keeping them open after the
+       server closes them)."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+class SharedJob:
+    def __init__(self, start: Callable[[Send], Awaitable[dict]]):
+        """Starts the job with `start`, passing it a function that sends its progress to each of the
+           `listeners` (the queries waiting on the job)."""
+        self.listeners: list[Send] = []
+        self.task = asyncio.ensure_future(start(self.send_progress))
+
+    async def send_progress(self, fields: dict) -> None:
+        for send in list(self.listeners):
+            try:
+                await send(fields)
+            except ConnectionError:
+                pass # that query's connection is gone, but the others still want the job's progress
+
+class EquityServer:
+    def __init__(self, executor: Executor, cache_size: int = DEFAULT_CACHE_SIZE):
+        """`executor` is usually a `worker_pool`."""
+        self.executor = executor
+        self.cache = LRUCache(cache_size)
+        """Maps each query's key to the `SharedJob` computing its result."""
+
+    async def _run(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _preflop(self, rules: GameRules, hand_type: HandType, num_opps: int, board: str,
+                       engine: str, seed: Optional[int], precision: Optional[float],
+                       max_trials: Optional[int], send_progress: Send) -> dict:
+        base_seed = random.randrange(2**32) if seed is None else seed
+        num_trials = trials_limit(precision, max_trials)
+        evs = {num_opps: EV(hand_type=hand_type)}
+        while True:
+            done = evs[num_opps].hands_played
+            chunk_end = done + CHUNK_TRIALS if num_trials is None else min(done + CHUNK_TRIALS, num_trials)
+            evs = await self._run(_preflop_chunk, engine, rules, hand_type, num_opps, board,
+                                  task_seed(base_seed, hand_type, done, rules), precision, chunk_end, evs)
+            if evs[num_opps].hands_played == num_trials or precise_enough(evs, precision):
+                return {'hand': str(hand_type), 'opps': num_opps, **_ev_fields(evs[num_opps])}
+            await send_progress(_ev_fields(evs[num_opps]))
+
+    async def _equity(self, rules: GameRules, hands: list[ranges.HandSpec], board: str, dead: str,
+                      exact: Optional[bool], seed: Optional[int], precision: Optional[float],
+                      max_trials: Optional[int], send_progress: Send) -> dict:
+        base_seed = random.randrange(2**32) if seed is None else seed
+        num_trials = trials_limit(precision, max_trials)
+        evs: Optional[list[EV]] = None
+        while True:
+            done = evs[0].hands_played if evs else 0
+            chunk_end = done + CHUNK_TRIALS if num_trials is None else min(done + CHUNK_TRIALS, num_trials)
+            evs = await self._run(_equity_chunk, rules.gametype, hands, board, dead, exact,
+                                  task_seed(base_seed, None, done, rules), precision, chunk_end, evs)
+            fields = {'hands': [{'hand': str(hand), **_ev_fields(ev)} for hand, ev in zip(hands, evs)]}
+            if (evs[0].exact or evs[0].hands_played == num_trials or
+                precise_enough(dict(enumerate(evs)), precision)):
+                return fields
+            await send_progress(fields)
+
+    def _job(self, query: dict) -> tuple[Hashable, Callable[[Send], Awaitable[dict]]]:
+        """Returns the cache key of `query`, and a function that starts computing its result (given a
+           function to send its progress with). Raises a KeyError, ValueError or TypeError if the
+           query is invalid."""
+        rules = compare.rules_for(GAMETYPES[_field(query, 'gametype', str)])
+        seed, exact = _field(query, 'seed', int), _field(query, 'exact', bool)
+        precision = float(p) if (p := _field(query, 'precision', (int, float))) is not None else None
+        max_trials = _field(query, 'max_trials', int)
+        board = _field(query, 'board', str, '')
+        if len(board) > 10:
+            raise ValueError("A board has at most 5 cards")
+        if query['query'] == 'preflop':
+            hand_type = parse_hand_type(_field(query, 'hand', str, ''), rules)
+            num_opps, engine = _field(query, 'opps', int, 0), _field(query, 'engine', str, 'python')
+            if num_opps < 1 or engine not in ('python', 'numpy'):
+                raise ValueError("`opps` must be at least 1, and `engine` 'python' or 'numpy'")
+            key: Hashable = ('preflop', rules.gametype, str(hand_type), num_opps, board, engine, seed,
+                             precision, max_trials)
+            return key, lambda send_progress: self._preflop(rules, hand_type, num_opps, board, engine, seed,
+                                                            precision, max_trials, send_progress)
+        if query['query'] == 'equity':
+            names, dead = _field(query, 'hands', list, []), _field(query, 'dead', str, '')
+            if not all(isinstance(name, str) for name in names):
+                raise TypeError("`hands` must be a list of strs")
+            hands = [_hand_spec(name, rules) for name in names]
+            if len(hands) < 2:
+                raise ValueError("An equity query needs at least 2 hands")
+            key = ('equity', rules.gametype, tuple(map(str, hands)), board, dead, exact, seed,
+                   precision, max_trials)
+            return key, lambda send_progress: self._equity(rules, hands, board, dead, exact, seed, precision,
+                                                           max_trials, send_progress)
+        raise ValueError(f"Unknown query: {query['query']}")
+
+    async def answer(self, query: dict, send: Send) -> None:
+        query_id = query.get('id')
+        async def send_progress(fields: dict) -> None:
+            await send({'id': query_id, 'event': 'progress', **fields})
+        try:
+            key, start_job = self._job(query)
+        except (KeyError, ValueError, TypeError) as e:
+            await send({'id': query_id, 'event': 'error', 'error': f"Invalid query ({type(e).__name__}: {e})"})
+            return
+        job: Optional[SharedJob] = self.cache.get(key)
+        cached = job is not None and job.task.done()
+        if job is None:
+            job = SharedJob(start_job)
+            self.cache.put(key, job)
+        job.listeners.append(send_progress)
+        try:
+            # Shielded, so that the job keeps going for the other queries sharing it if this one's
+            # connection is closed:
+            result = await asyncio.shield(job.task)
+        except Exception as e:
+            self.cache.discard(key)
+            await send({'id': query_id, 'event': 'error', 'error': f"{type(e).__name__}: {e}"})
+            return
+        finally:
+            job.listeners.remove(send_progress)
+        await send({'id': query_id, 'event': 'result', 'cached': cached, **result})
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        lock = asyncio.Lock()
+        async def send(message: dict) -> None:
+            async with lock:
+                if not writer.is_closing():
+                    writer.write((json.dumps(message) + '\n').encode())
+                    await writer.drain()
+        tasks: set[asyncio.Task] = set()
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                try:
+                    query = json.loads(line)
+                    if not isinstance(query, dict):
+                        raise ValueError
+                except ValueError:
+                    await send({'id': None, 'event': 'error', 'error': "Each line must be a JSON object"})
+                    continue
+                task = asyncio.create_task(self.answer(query, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # The client has finished sending, but can still be waiting for the replies:
+            await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def serve(server: EquityServer, port: int = DEFAULT_PORT, socket_path: Optional[str] = None) -> None:
+    if socket_path:
+        listener = await asyncio.start_unix_server(server.handle_connection, path=socket_path)
+    else:
+        listener = await asyncio.start_server(server.handle_connection, '127.0.0.1', port)
+    print(f"Listening on {socket_path or f'127.0.0.1:{port}'}")
+    async with listener:
+        await listener.serve_forever()
+
+def main() -> None:
+    Utils.pypy_notice()
+    workers = int(Utils.flag_value('--workers', str(os.cpu_count() or 1)))
+    cache_size = int(Utils.flag_value('--cache-size', str(DEFAULT_CACHE_SIZE)))
+    port = int(Utils.flag_value('--port', str(DEFAULT_PORT)))
+    with worker_pool(workers) as executor:
+        try:
+            asyncio.run(serve(EquityServer(executor, cache_size), port, Utils.flag_value('--socket')))
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
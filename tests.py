@@ -1,8 +1,12 @@
 from copy import deepcopy
+from itertools import combinations
+import math
+import random
 import pytest
 
 import compare
 from compare import GameType
+import evaluator
 
 _mapping = str.maketrans("TJQKA", ":;<=>")
 _rankings: dict = {0: "high card", 1: "one pair", 2: "two pair", 3: "trips", 4: "straight",
@@ -58,7 +62,6 @@ def assert_rankings(cards: tuple[str, ...]):
         )
         assert _rankings[rank_list[5]] == cards[i+1]
 
-# todo - make test for getting best 5 card hand from 7 or 9 cards.
 
 @pytest.mark.parametrize("cards", omaha_hands())
 def test_omaha_matchups(cards: tuple[str, ...]):
@@ -72,4 +75,540 @@ def test_holdem_matchups(cards: tuple[str, ...]):
     if cards[1] != cards[2]:
         # doesn't test comparing hands that have the same rank (e.g., boat vs boat)
         assert compare.is_first_hand_better(cards[0]) is (_rankings[cards[1]] > _rankings[cards[2]])
-    assert_rankings(cards)
\ No newline at end of file
+    assert_rankings(cards)
+
+def legacy_vals(cards: list[int]) -> tuple[int, ...]:
+    """Converts int-encoded cards to the ord-based vals that the list-based functions in compare.py take."""
+    return tuple(ord(evaluator.VALS[c >> 2].translate(_mapping)) for c in cards)
+
+def legacy_rank_list(cards: list[int]) -> list[int]:
+    return compare.getHandRankFromFiveCards(sorted(legacy_vals(cards)), len({c & 3 for c in cards}) == 1)
+
+@pytest.mark.parametrize("gametype", [GameType.TEXAS, GameType.SHORTDECK, GameType.SHORTDECK_TRIPS])
+def test_evaluate5_matches_legacy_order(gametype: GameType):
+    compare.set_gametype(gametype)
+    deck = [c for c in range(52) if c >> 2 >= 13 - compare.num_card_vals()]
+    rng = random.Random(0)
+    hands = [rng.sample(deck, 5) for _ in range(2000)]
+    for h1, h2 in zip(hands, hands[1:]):
+        s1, s2 = compare.evaluator().evaluate5(*h1), compare.evaluator().evaluate5(*h2)
+        r1, r2 = legacy_rank_list(h1), legacy_rank_list(h2)
+        assert evaluator.category_rank(s1) == r1[5]
+        assert (None if s1 == s2 else s1 > s2) == compare.first5HandIsBetter(r1, r2)
+
+@pytest.mark.parametrize("gametype", list(GameType))
+def test_best_hand_matches_every_combo(gametype: GameType):
+    compare.set_gametype(gametype)
+    deck = [c for c in range(52) if c >> 2 >= 13 - compare.num_card_vals()]
+    rng = random.Random(1)
+    for _ in range(1000):
+        cards = rng.sample(deck, compare.num_hole_cards() + 5)
+        hole, board = cards[:compare.num_hole_cards()], cards[compare.num_hole_cards():]
+        strength = compare.evaluator().best_hand(hole, compare.evaluator().prepare_board(board))
+        assert strength == compare.evaluator().best_strength(hole, board)
+        legacy = compare.getBestComb(legacy_vals(hole), tuple(c & 3 for c in hole),
+                                     legacy_vals(board), tuple(c & 3 for c in board))
+        assert evaluator.category_rank(strength) == legacy[5]
+
+def test_strength_bound_is_an_upper_bound():
+    rules = compare.rules_for(GameType.OMAHA)
+    rng = random.Random(6)
+    num_bounded = num_exact_categories = 0
+    for _ in range(20000):
+        cards = rng.sample(range(52), 9)
+        bounds = rules.evaluator.prepare_bounds(cards[4:])
+        assert (bounds is None) == (len({card >> 2 for card in cards[4:]}) < 5)
+        if bounds is not None:
+            strength = rules.evaluator.best_hand(cards[:4], rules.evaluator.prepare_board(cards[4:]))
+            bound = rules.evaluator.strength_bound(cards[:4], bounds)
+            assert strength <= bound
+            num_bounded += 1
+            num_exact_categories += evaluator.category_rank(strength) == evaluator.category_rank(bound)
+    # Loose bounds wouldn't rule out many opps:
+    assert num_exact_categories > 0.85 * num_bounded
+
+@pytest.mark.parametrize("gametype", list(GameType))
+def test_vectorized_evaluate_matches_best_hand(gametype: GameType):
+    np = pytest.importorskip("numpy")
+    import vectorized
+    compare.set_gametype(gametype)
+    deck = [c for c in range(52) if c >> 2 >= 13 - compare.num_card_vals()]
+    rng = random.Random(2)
+    deals = np.array([rng.sample(deck, 2 * compare.num_hole_cards() + 5) for _ in range(2000)])
+    h = compare.num_hole_cards()
+    strengths = vectorized.evaluate([deals[:, :h], deals[:, h:2*h]], deals[:, 2*h:])
+    for deal, row in zip(deals.tolist(), strengths.tolist()):
+        board_info = compare.evaluator().prepare_board(deal[2*h:])
+        assert row == [compare.evaluator().best_hand(deal[:h], board_info),
+                       compare.evaluator().best_hand(deal[h:2*h], board_info)]
+
+@pytest.mark.parametrize("gametype", [GameType.TEXAS, GameType.OMAHA])
+def test_vectorized_run_sims_matches_python_run_sims(gametype: GameType):
+    pytest.importorskip("numpy")
+    import vectorized
+    from main import HandType2Cards, HandType4Cards, run_sims
+    compare.set_gametype(gametype)
+    hand_type = (HandType4Cards(('A', 'K', 'Q', 'J')) if gametype == GameType.OMAHA else
+                 HandType2Cards('T', '9', True))
+    python_evs = run_sims(hand_type, 1, 3, seed=4, max_trials=10000)
+    numpy_evs = vectorized.run_sims(hand_type, 1, 3, seed=4, max_trials=10000)
+    for num_opps in range(1, 4):
+        python_ev, numpy_ev = python_evs[num_opps], numpy_evs[num_opps]
+        assert python_ev.hands_played == numpy_ev.hands_played == 10000
+        # Within the 95% confidence interval of the difference between the two estimates:
+        assert abs(python_ev.ev() - numpy_ev.ev()) < math.hypot(python_ev.confidence_interval(),
+                                                                numpy_ev.confidence_interval())
+
+def test_ev_confidence_interval():
+    from main import EV
+    ev = EV()
+    for i in range(100):
+        ev.add_result(i % 2)
+    assert ev.ev() == 50.0
+    assert ev.confidence_interval() == round(1.96 * (0.25 * 100 / 99 / 100) ** 0.5 * 100, 3)
+
+@pytest.mark.parametrize('engine', ['python', 'numpy'])
+def test_run_sims_stops_at_precision_or_max_trials(engine: str):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    from main import PRECISION_CHECK_INTERVAL, HandType2Cards, precise_enough, simulator
+    compare.set_gametype(GameType.TEXAS)
+    run_sims, hand_type = simulator(engine), HandType2Cards('A', 'K', True)
+    # The python engine checks the precision every PRECISION_CHECK_INTERVAL trials, and the numpy one
+    # after each block (of 10000 trials by default):
+    interval = PRECISION_CHECK_INTERVAL if engine == 'python' else 10000
+    evs = run_sims(hand_type, 1, 2, seed=3, precision=0.5)
+    num_trials = evs[2].hands_played
+    assert all(ev.confidence_interval() <= 0.5 for ev in evs.values()) and num_trials % interval == 0
+    # The same trials, but stopping at the check before, weren't precise enough yet:
+    assert not precise_enough(run_sims(hand_type, 1, 2, seed=3, max_trials=num_trials - interval), 0.5)
+    for precision in (None, 0.01):
+        evs = run_sims(hand_type, 1, 2, seed=3, precision=precision, max_trials=1500)
+        assert evs[1].hands_played == evs[2].hands_played == 1500
+
+def test_ev_merge():
+    from main import EV
+    evs = [EV() for _ in range(3)]
+    for i in range(300):
+        evs[i % 3].add_result(i % 5)
+    total = EV()
+    for i in range(300):
+        total.add_result(i % 5)
+    for merged in (evs[0].merge(evs[1]).merge(evs[2]), evs[2].merge(evs[0].merge(evs[1]))):
+        assert (merged.wins, merged.losses, merged.splits) == (60, 60, {2: 60, 3: 60, 4: 60})
+        assert merged.hands_played == 300 and merged.ev() == total.ev()
+        assert merged.confidence_interval() == total.confidence_interval()
+    assert EV.from_state(None, total.state()) == total
+
+def test_omaha_suit_types_cover_every_hand_once():
+    from main import OmahaSuitType
+    hand_types = OmahaSuitType.all_hand_types()
+    assert len(set(hand_types)) == len(hand_types)
+    assert sum(hand_type.num_combos() for hand_type in hand_types) == 270725
+    assert all(len(hand_type.concrete_hands()) == hand_type.num_combos() for hand_type in hand_types)
+
+def test_versus_suit_symmetries_keep_exact_ev():
+    import versus
+    compare.set_gametype(GameType.OMAHA)
+    hands = [evaluator.encode_cards("AsAhKsKh"), evaluator.encode_cards("QdQcJdJc")]
+    cards_in_play = hands[0] + hands[1] + [c for c in range(52) if c >> 2 < 7] # no 2s through 8s
+    rem_cards = [c for c in range(51, -1, -1) if c not in cards_in_play]
+    symmetries = versus.suit_symmetries(cards_in_play)
+    assert len(symmetries) == 4
+    evs = []
+    for syms in (symmetries, symmetries[:1]):
+        pots_won, num_boards = 0.0, 0
+        for board, weight in versus.canonical_boards(rem_cards, syms):
+            winners = compare.winners(hands, board)
+            pots_won += weight * (0.5 if len(winners) == 2 else winners == [0])
+            num_boards += weight
+        evs.append((pots_won, num_boards))
+    assert evs[0] == evs[1]
+
+def test_versus_results_file_round_trips(tmp_path, monkeypatch):
+    import sys
+    import versus
+    from main import EV
+    monkeypatch.chdir(tmp_path)
+    exclude_str = ''.join(v + s for v in '2345678' for s in 'shdc')
+    monkeypatch.setattr(sys, 'argv', ['versus.py', 'AsAhKsKh', 'QdQcJdJc', exclude_str])
+    versus.main()
+    [filepath] = (tmp_path / 'tests').glob('*.bin')
+    header, records = versus.read_results(str(filepath))
+    assert header == versus.ResultsHeader('AsAhKsKh QdQcJdJc', exclude_str, '')
+    assert len(header.symmetries()) == 4
+    # Every board, without the symmetries:
+    hands = [evaluator.encode_cards("AsAhKsKh"), evaluator.encode_cards("QdQcJdJc")]
+    rem_cards = [c for c in range(51, -1, -1) if c >> 2 >= 7 and c not in hands[0] + hands[1]]
+    total = EV()
+    for board in combinations(rem_cards, 5):
+        winners = compare.winners(hands, board)
+        total.add_result(versus.num_winners(None if len(winners) == 2 else winners == [0]))
+    assert sum(weight for _, weight, _ in records) == math.comb(16, 5) == total.hands_played
+    before, after = versus.trim(str(filepath), [], write=False)
+    assert before == after == total
+    text_path = versus.export_to_text(str(filepath))
+    exported = EV()
+    with open(text_path) as f:
+        for line in f:
+            assert line.startswith('AsAhKsKh QdQcJdJc ')
+            _, weight, result = versus.parse_line(line.rstrip('\n'))
+            exported.add_result(versus.num_winners(result), weight)
+    assert exported == total
+    # Swapping the suits of the hands maps a Tc filter onto a Td one, and the filters match the full
+    # enumeration's:
+    for filters in (['flush'], ['AcKd', 'None'], ['Td'], ['Tc']):
+        kept = EV()
+        for board in combinations(rem_cards, 5):
+            board_str = ''.join(evaluator.decode_card(c) for c in board)
+            winners = compare.winners(hands, board)
+            result = None if len(winners) == 2 else winners == [0]
+            if versus.keep_board(board_str, result, filters):
+                kept.add_result(versus.num_winners(result))
+        assert versus.trim(str(filepath), filters, write=False)[1] == kept
+    versus.trim(str(filepath), ['Tc'], write=True)
+    [trimmed_path] = [path for path in (tmp_path / 'tests').glob('*.bin') if path != filepath]
+    assert versus.trim(str(trimmed_path), [], write=False)[0] == kept
+    with pytest.raises(ValueError):
+        versus.trim(text_path, ['Tc'], write=False)
+
+def test_checkpoints_save_load_and_clean_up(tmp_path):
+    from checkpoint import Checkpoints
+    checkpoints = Checkpoints(str(tmp_path / 'sweep'))
+    assert not checkpoints.exists() and checkpoints.load('AKs') is None
+    assert checkpoints.save_if_missing('meta', {'base_seed': 1}) == {'base_seed': 1}
+    assert checkpoints.save_if_missing('meta', {'base_seed': 2}) == {'base_seed': 1}
+    checkpoints.save('AKs', {'done': False})
+    checkpoints.save('AKs', {'done': True})
+    assert checkpoints.has('AKs') and checkpoints.load('AKs') == {'done': True}
+    checkpoints.remove_folder_if_unused('meta') # AKs still uses it
+    assert checkpoints.exists()
+    checkpoints.remove('AKs')
+    checkpoints.remove_folder_if_unused('meta')
+    assert not checkpoints.exists()
+
+def test_run_sims_resumes_from_saved_evs(tmp_path):
+    from checkpoint import Checkpoints
+    from main import CHECKPOINT_INTERVAL, HandType2Cards, _load_checkpoint, _save_checkpoint, run_sims
+    compare.set_gametype(GameType.TEXAS)
+    checkpoints = Checkpoints(str(tmp_path / 'sweep'))
+    hand_type = HandType2Cards('Q', 'J', True)
+    on_progress = lambda evs: _save_checkpoint(checkpoints, hand_type, False, evs)
+    full = run_sims(hand_type, 1, 3, seed=7, max_trials=CHECKPOINT_INTERVAL + 500, on_progress=on_progress)
+    # As if killed after the checkpoint:
+    done, saved = _load_checkpoint(checkpoints, hand_type)
+    assert not done and saved is not None and saved[3].hands_played == CHECKPOINT_INTERVAL
+    resumed = run_sims(hand_type, 1, 3, seed=8, max_trials=CHECKPOINT_INTERVAL + 500, initial_evs=saved)
+    for num_opps in range(1, 4):
+        assert resumed[num_opps].hands_played == full[num_opps].hands_played == CHECKPOINT_INTERVAL + 500
+        assert resumed[num_opps].wins >= _load_checkpoint(checkpoints, hand_type)[1][num_opps].wins
+        assert abs(resumed[num_opps].ev() - full[num_opps].ev()) < 3
+
+def test_sweep_with_workers_matches_serial_sweep(tmp_path, monkeypatch):
+    import sys
+    import main
+    monkeypatch.chdir(tmp_path)
+    written: dict[int, dict[str, dict]] = {}
+    monkeypatch.setattr(main, 'write_results', lambda results, num_opps, board_str='': written.update(
+        {num_opps: {str(ev.hand_type): ev.state() for ev in results}}))
+    sweeps = []
+    for workers in ('1', '3'):
+        monkeypatch.setattr(sys, 'argv', ['main.py', '1-2', 'shortdeck', '/', '--max-trials', '300',
+                                          '--seed', '5', '--workers', workers])
+        main.main()
+        sweeps.append(dict(written))
+    assert len(sweeps[0][2]) == len(main.HandType2Cards.all_hand_types(compare.game_rules())) // 4
+    assert sweeps[0] == sweeps[1]
+
+def test_results_store_accumulates(tmp_path):
+    from main import EV, HandType2Cards, OmahaSuitType
+    from results_store import ResultsStore
+    store = ResultsStore(str(tmp_path / 'results.sqlite3'))
+    aces, kings = HandType2Cards('A', 'A', False), HandType2Cards('K', 'K', False)
+    store.add(GameType.TEXAS, {1: [EV(aces, 80, 100, 70), EV(kings, 70, 100, 60)]})
+    store.add(GameType.TEXAS, {1: [EV(aces, 90, 100, 85)], 2: [EV(aces, 60, 100, 50)]})
+    store.add(GameType.OMAHA, {1: [EV(OmahaSuitType('AKQJ'), 60, 100, 50)]})
+    ev = store.get(GameType.TEXAS, 'AA', 1)
+    assert ev is not None and (ev.pots_won, ev.hands_played, ev.pots_won_squared) == (170, 200, 155)
+    assert [str(ev.hand_type) for ev in store.results(GameType.TEXAS, 1)] == ['AA', 'KK']
+    assert store.opp_counts(GameType.TEXAS) == [1, 2]
+    assert store.get(GameType.OMAHA, 'AKQJ', 1) is None
+    assert store.get(GameType.OMAHA, 'AKQJ', 1, 'suit classes') is not None
+    counted = EV(kings)
+    for num_winners in (0, 1, 1, 2, 3):
+        counted.add_result(num_winners)
+    store.add(GameType.TEXAS, {1: [counted]})
+    ev = store.get(GameType.TEXAS, 'KK', 1)
+    assert ev is not None and (ev.hands_played, ev.wins, ev.losses, ev.splits) == (105, 2, 1, {2: 1, 3: 1})
+    # A resumed sweep adding its results again only adds the hand types it hadn't:
+    queens = HandType2Cards('Q', 'Q', False)
+    assert store.add(GameType.TEXAS, {1: [EV(kings, 70, 100, 60)], 2: [EV(kings, 50, 100, 40)]}, 'sweep') == 0
+    assert store.add(GameType.TEXAS, {1: [EV(kings, 70, 100, 60), EV(queens, 65, 100, 50)],
+                                      2: [EV(kings, 50, 100, 40)]}, 'sweep') == 1
+    assert store.add(GameType.TEXAS, {1: [EV(kings, 70, 100, 60)]}, 'another sweep') == 0
+    ev, queens_ev = store.get(GameType.TEXAS, 'KK', 1), store.get(GameType.TEXAS, 'QQ', 1)
+    assert ev is not None and ev.hands_played == 305 and queens_ev is not None and queens_ev.hands_played == 100
+    ev = store.get(GameType.TEXAS, 'KK', 2)
+    assert ev is not None and ev.hands_played == 100
+    store.close()
+
+def test_combiner_merges_parsed_lines():
+    from main import EV, HandType2Cards
+    from results_store import parse_results_line
+    from combiner import merge
+    ev = EV(HandType2Cards('A', 'K', True), 600.5, 1000, 480.25)
+    line = parse_results_line(f"#3: {ev} vs 2 opps")
+    assert (line.hand_type, line.num_opps, line.equity) == ('AKs', 2, ev.ev())
+    assert line.ev is not None and str(line.ev) == str(ev)
+    merged = merge([line, parse_results_line(f"#5: {ev} vs 2 opps")])
+    assert merged.ev is not None and merged.ev.hands_played == 2000 and merged.equity == ev.ev()
+    old = parse_results_line("#1: AKs wins 61.0% of the pot on avg vs 2 opps")
+    assert old.ev is None and merge([line, old]).equity == round((ev.ev() + 61.0) / 2, 3)
+    counted = EV(HandType2Cards('A', 'K', True))
+    for num_winners, count in ((1, 550), (0, 420), (2, 25), (3, 5)):
+        counted.add_result(num_winners, count)
+    assert '550 wins, 30 splits (2-way: 25, 3-way: 5), 420 losses' in str(counted)
+    line = parse_results_line(f"#3: {counted} vs 2 opps")
+    assert line.ev is not None and str(line.ev) == str(counted)
+    assert (line.ev.wins, line.ev.splits, line.ev.losses) == (550, {2: 25, 3: 5}, 420)
+    merged = merge([line, parse_results_line(f"#5: {counted} vs 2 opps")])
+    assert merged.ev is not None and (merged.ev.wins, merged.ev.splits) == (1100, {2: 50, 3: 10})
+    assert merged.ev.confidence_interval() == counted.merge(counted).confidence_interval()
+    # Merged with a line without the counts, the counts are left out rather than undercounted:
+    assert 'wins,' not in str(merge([line, parse_results_line(f"#3: {ev} vs 2 opps")]).ev)
+
+def test_discrepancy_z_score():
+    from main import EV
+    from discrepancy import z_score
+    ev_1, ev_2 = EV(None, 500, 1000, 500), EV(None, 600, 1000, 600)
+    assert z_score(ev_1, None) is None
+    assert z_score(ev_1, ev_1) == 0
+    assert z_score(ev_2, ev_1) == pytest.approx(10 / math.hypot(ev_1.confidence_interval(),
+                                                                ev_2.confidence_interval()) * 1.96)
+
+@pytest.mark.parametrize('gametype', [GameType.TEXAS, GameType.OMAHA])
+def test_range_equity_matches_brute_force(gametype: GameType):
+    from itertools import combinations
+    from main import HandType2Cards, HandType4Cards
+    from ranges import Range, equity, whole_weights
+    compare.set_gametype(gametype)
+    if gametype == GameType.OMAHA:
+        hero, villain = Range(['AsAhKsKh']), Range({HandType4Cards(('Q', 'Q', 'J', 'J')): 2, 'AdAc9s8s': 1})
+        board = evaluator.encode_cards("QcTs5d2h")
+    else:
+        hero, villain = Range(['AsAh']), Range({HandType2Cards('K', 'Q', True): 2, 'AdAc': 1})
+        board = evaluator.encode_cards("Qs7d2h")
+    evs = equity([hero, villain], board, exact=True)
+    expected = [0.0, 0.0]
+    hero_counts = [0, 0, 0] # wins, splits and losses, with each deal counted by its villain hand's weight
+    for villain_hand, weight in zip(villain.hands, villain.weights):
+        used = set(hero.hands[0]) | set(villain_hand) | set(board)
+        if len(used) < len(hero.hands[0]) + len(villain_hand) + len(board):
+            continue
+        for rest in combinations([c for c in range(52) if c not in used], 5 - len(board)):
+            winners = compare.winners([hero.hands[0], villain_hand], board + list(rest))
+            for i in winners:
+                expected[i] += weight / len(winners)
+            hero_counts[0 if winners == [0] else 1 if len(winners) == 2 else 2] += int(weight)
+    total = sum(expected)
+    assert [ev.ev() for ev in evs] == [round(x / total * 100, 3) for x in expected]
+    assert (evs[0].wins, evs[0].splits.get(2, 0), evs[0].losses) == tuple(hero_counts)
+    assert evs[0].hands_played == sum(hero_counts) and evs[0].confidence_interval() == 0
+    assert whole_weights([0.5, 1.5, 1.0]) == [1, 3, 2]
+    simulated = equity([hero, villain], board, exact=False, seed=0, max_trials=4000)
+    assert abs(simulated[0].ev() - evs[0].ev()) < 4 * simulated[0].confidence_interval() / 1.96
+    continued = equity([hero, villain], board, seed=1, max_trials=6000, initial_evs=simulated)
+    assert continued[1].hands_played == 6000 and not continued[1].exact
+
+def test_preflop_matrix_board_totals():
+    pytest.importorskip('numpy')
+    from math import comb
+    from preflop_matrix import _Builder, canonical_boards
+    compare.set_gametype(GameType.SHORTDECK)
+    boards = list(canonical_boards(9))
+    assert sum(weight for _, weight in boards) == comb(36, 5) and len(set(boards)) == len(boards)
+    builder = _Builder()
+    board = tuple(evaluator.encode_cards("AsKsQd9d6c"))
+    builder.add_board(board, 1)
+    for i, j in [(0, 1), (1, 1), (5, 30), (40, 2)]:
+        half_pots, matchups = 0, 0
+        for hand in builder.hand_types[i].concrete_hands():
+            for other in builder.hand_types[j].concrete_hands():
+                if len(set(hand) | set(other) | set(board)) == 9:
+                    winners = compare.winners([hand, other], board)
+                    half_pots += 2 // len(winners) if 0 in winners else 0
+                    matchups += 1
+        assert (builder.half_pots[i, j], builder.matchups[i, j]) == (half_pots, matchups)
+
+def test_benchmark_regressions():
+    from benchmark import measure, regressions
+    calls = []
+    assert measure(calls.append, 10, 0.01, 2) > 0 and set(calls) == {10}
+    assert regressions({'a': 89.0, 'b': 91.0, 'c': 1.0}, {'a': 100.0, 'b': 100.0}, 0.1) == ['a']
+    # A benchmark with no result (e.g. one that started crashing) is a regression too:
+    assert regressions({'b': 91.0}, {'a': 100.0, 'b': 100.0}, 0.1) == ['a']
+    assert regressions({'b': 91.0}, {'a': 100.0, 'b': 100.0}, 0.1, only='b') == []
+
+def test_instrumentation_collects_only_when_enabled():
+    import instrumentation
+    compare.set_gametype(GameType.SHORTDECK)
+    instrumentation.disable()
+    assert instrumentation.active() is None
+    with instrumentation.phase('io'): # does nothing while disabled
+        pass
+    stats = instrumentation.enable()
+    stats.count_strengths([compare.evaluator().strength(evaluator.FLUSH, (12,)),
+                           compare.evaluator().strength(evaluator.BOAT, (12, 11))])
+    stats.record_trials(2, 0.0, 1.0, 3.0, 6.0)
+    taken = stats.take()
+    assert stats.trials == 0 and taken.trials == 2
+    stats.merge(taken)
+    with instrumentation.phase('io'):
+        pass
+    report = stats.report()
+    assert report['trials'] == 2 and report['hand_categories'] == {'flush': 0.5, 'boat': 0.5}
+    assert report['phase_seconds']['evaluation'] == 2 and 'io' in report['phase_seconds']
+    instrumentation.disable()
+
+def test_run_sims_stats_time_comparison_and_count_heroes():
+    import instrumentation
+    from main import HandType4Cards, run_sims
+    compare.set_gametype(GameType.OMAHA)
+    stats = instrumentation.enable()
+    run_sims(HandType4Cards(('A', 'A', 'K', 'K')), 1, 6, seed=0, max_trials=500)
+    instrumentation.disable()
+    # Opps are skipped once the hero is beaten, and pruned by bounds, but each trial has one hero:
+    assert stats.trials == sum(stats.category_counts) == 500
+    assert stats.phase_seconds['comparison'] > 0
+
+def test_dealer_deals_uniformly_without_excluded_cards():
+    from dealer import Dealer
+    from main import HandType2Cards, run_sims
+    dealer = Dealer(range(16, 52), random.Random(0))
+    counts = [0] * 52
+    for i in range(36000):
+        excluded = (51, 16 + i % 30)
+        dealt = dealer.deal(excluded, 5)[:5]
+        assert len(set(dealt)) == 5 and not set(dealt) & set(excluded)
+        for card in dealt:
+            counts[card] += 1
+    assert sorted(dealer.deck) == list(range(16, 52)) and counts[51] == 0
+    # Each of the cards 46 to 50 is never excluded, so it's dealt in 5 of the 34 cards dealt from:
+    assert all(abs(count - 36000 * 5 / 34) < 300 for count in counts[46:51])
+    compare.set_gametype(GameType.SHORTDECK)
+    runs = [run_sims(HandType2Cards('A', 'K', True), 1, 3, seed=1, max_trials=1000) for _ in range(2)]
+    assert runs[0] == runs[1] and runs[0][3].hands_played == 1000
+
+def test_scenario_dealer_deals_the_same_scenarios_to_every_hand():
+    from dealer import ScenarioDealer, board_texture, texture_probabilities
+    from main import HandType2Cards, run_sim
+    heroes = ((), (48, 49), (0, 5))
+    dealers = [ScenarioDealer(range(52), random.Random(3), 6, 5, 2, stratified=True) for _ in heroes]
+    strata_counts = [0] * 4
+    for trial in range(4000):
+        unblocked, *scenarios = [dealer.deal(hero, trial)[:] for dealer, hero in zip(dealers, heroes)]
+        strata_counts[board_texture(unblocked[6:])] += 1
+        for scenario, hero in zip(scenarios, heroes[1:]):
+            assert len(set(scenario)) == 11 and not set(scenario) & set(hero)
+            # The scenarios only differ where they collide with the hero's hand:
+            assert (scenario == unblocked) == (not set(unblocked) & set(hero))
+    # Stratified, so the textures are in almost exactly their proportions:
+    for num_boards, probability in zip(strata_counts, texture_probabilities(range(52))):
+        assert abs(num_boards - 4000 * probability) < 40
+    compare.set_gametype(GameType.TEXAS)
+    # The same seed gives both hand types the same opps and boards, so the difference between them is
+    # much less noisy, and they agree with independent sampling:
+    suited, offsuit = HandType2Cards('K', '9', True), HandType2Cards('K', '9', False)
+    for sampling in ('common', 'stratified'):
+        diff = run_sim(suited, 2, seed=4, max_trials=3000, sampling=sampling).ev() - \
+               run_sim(offsuit, 2, seed=4, max_trials=3000, sampling=sampling).ev()
+        assert 1 < diff < 6
+
+def test_game_rules_mix_gametypes_in_one_process():
+    import pickle
+    from main import HandType2Cards, run_sims
+    compare.set_gametype(GameType.TEXAS)
+    shortdeck = compare.rules_for(GameType.SHORTDECK)
+    assert pickle.loads(pickle.dumps(shortdeck)) is shortdeck
+    boat_vs_flush = "AhKh AsAc QhJh9hAdQc" # a flush for the 1st hand, a boat for the 2nd
+    assert compare.is_first_hand_better(boat_vs_flush) is False
+    assert compare.is_first_hand_better(boat_vs_flush, shortdeck) is True
+    assert len(HandType2Cards.all_hand_types(shortdeck)) == 81 and len(HandType2Cards.all_hand_types()) == 169
+    evs = run_sims(HandType2Cards('A', 'K', True), 1, 1, seed=0, max_trials=100, rules=shortdeck)
+    assert evs[1].hands_played == 100 and compare.gametype() == GameType.TEXAS
+
+def test_server_answers_and_caches_queries():
+    import asyncio
+    import json
+    import server
+    assert str(server.parse_hand_type('KAs', compare.rules_for(GameType.TEXAS))) == 'AKs'
+    assert str(server.parse_hand_type('KAKA', compare.rules_for(GameType.OMAHA))) == 'AAKK'
+    with pytest.raises(ValueError):
+        server.parse_hand_type('AKs', compare.rules_for(GameType.OMAHA))
+    cache = server.LRUCache(2)
+    for key in 'abca':
+        cache.put(key, key)
+    assert len(cache) == 2 and cache.get('b') is None and cache.get('c') == 'c'
+
+    async def ask(port: int, queries: list) -> list[dict]:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(''.join(json.dumps(query) + '\n' for query in queries).encode())
+        writer.write_eof()
+        replies = [json.loads(line) async for line in reader]
+        writer.close()
+        return replies
+
+    async def run() -> None:
+        with server.worker_pool(1) as executor:
+            equity_server = server.EquityServer(executor)
+            listener = await asyncio.start_server(equity_server.handle_connection, '127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            equity = {'query': 'equity', 'gametype': 'texas', 'hands': ['AsAh', 'KK'], 'board': 'Ks7d2c'}
+            preflop = {'query': 'preflop', 'gametype': 'shortdeck', 'hand': 'AKs', 'opps': 2,
+                       'max_trials': 2 * server.CHUNK_TRIALS // 10, 'seed': 1}
+            sampled = {**equity, 'exact': False, 'max_trials': 2 * server.CHUNK_TRIALS // 10, 'seed': 1}
+            server.CHUNK_TRIALS //= 10
+            try:
+                # The second copy of the preflop query shares the first one's job:
+                replies = await ask(port, [{**equity, 'id': 1}, {**preflop, 'id': 2}, {**preflop, 'id': 5},
+                                           {**sampled, 'id': 6},
+                                           {'query': 'preflop', 'gametype': 'texas', 'hand': 'AKx', 'id': 3},
+                                           {'query': 'preflop', 'gametype': 'texas', 'hand': ['AK'], 'id': 4},
+                                           ['not', 'a', 'query']])
+                again = await ask(port, [equity])
+            finally:
+                server.CHUNK_TRIALS *= 10
+            listener.close()
+        by_id = {(reply['id'], reply['event']): reply for reply in replies}
+        assert by_id[1, 'result']['hands'][1]['hand'] == 'KK' and not by_id[1, 'result']['cached']
+        assert by_id[1, 'result']['hands'][0]['ev'] == again[0]['hands'][0]['ev'] and again[0]['cached']
+        assert by_id[2, 'progress']['hands_played'] == server.CHUNK_TRIALS // 10
+        assert by_id[2, 'result']['hands_played'] == 2 * server.CHUNK_TRIALS // 10
+        assert by_id[5, 'progress']['hands_played'] == server.CHUNK_TRIALS // 10
+        assert by_id[5, 'result']['ev'] == by_id[2, 'result']['ev']
+        assert by_id[6, 'progress']['hands'][0]['hands_played'] == server.CHUNK_TRIALS // 10
+        assert by_id[6, 'result']['hands'][1]['hands_played'] == 2 * server.CHUNK_TRIALS // 10
+        assert by_id[1, 'result']['hands'][0]['ci'] is None and by_id[6, 'result']['hands'][0]['ci'] > 0
+        assert 'error' in by_id[3, 'error'] and 'TypeError' in by_id[4, 'error']['error']
+        assert by_id[None, 'error']['error'] == "Each line must be a JSON object"
+    asyncio.run(run())
+
+@pytest.mark.parametrize('gametype', [GameType.TEXAS, GameType.OMAHA])
+def test_partial_board_matches_full_board(gametype: GameType):
+    compare.set_gametype(gametype)
+    ev_, rng = compare.evaluator(), random.Random(2)
+    for _ in range(200):
+        cards = rng.sample(range(52), 13)
+        hole, board, known = cards[:4 if ev_.omaha else 2], cards[8:], rng.randrange(6)
+        assert ev_.best_hand(hole, ev_.complete_board(ev_.prepare_partial_board(board[:known]), board[known:])) \
+            == ev_.best_hand(hole, ev_.prepare_board(board))
+
+def test_run_sim_with_known_flop():
+    from main import HandType2Cards, run_sim
+    import ranges
+    compare.set_gametype(GameType.TEXAS)
+    # With 2 cards to come, the exact equity is quick, and the simulation is within its noise of it:
+    hand_type, flop = HandType2Cards('A', 'A', False), evaluator.encode_cards('Ks7d2c')
+    exact = ranges.equity([ranges.Range([hand_type]), ranges.Range(HandType2Cards.all_hand_types())], flop)[0]
+    simulated = run_sim(hand_type, 1, seed=0, max_trials=20000, board=flop)
+    assert abs(simulated.ev() - exact.ev()) < 2 * simulated.confidence_interval()
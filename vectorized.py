@@ -0,0 +1,168 @@
+"""A NumPy version of `main.run_sim`. Trials are dealt and evaluated in blocks of int arrays (cards are
+encoded as in evaluator.py), rather than one at a time. `main.run_sim` stays as the reference
+implementation; this module is only imported when the numpy engine is chosen."""
+
+from __future__ import annotations
+from itertools import combinations, combinations_with_replacement, permutations
+from time import perf_counter
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+import compare
+from compare import GameRules, GameType
+import evaluator
+import instrumentation
+from main import EV, HandType, trials_limit, precise_enough
+
+_BOARD_TRIPLES = np.array(list(combinations(range(5), 3)))
+_HOLE_PAIRS = np.array(list(combinations(range(4), 2)))
+
+class _Tables:
+    """The evaluator's lookup tables for a gametype, as arrays."""
+    def __init__(self, rules: GameRules) -> None:
+        self.lowest_card = rules.deck[0]
+        self.omaha = rules.omaha
+        num_cards = 5 if self.omaha else 7
+        unsuited = rules.evaluator.unsuited_table(
+            num_cards, range(len(evaluator.VALS) - rules.num_card_vals, len(evaluator.VALS))
+        )
+        self.unsuited_keys = np.array(sorted(unsuited), dtype=np.int64)
+        self.unsuited_strengths = np.array([unsuited[k] for k in sorted(unsuited)], dtype=np.int64)
+        self.flush = np.array(rules.evaluator.flush_table(num_cards), dtype=np.int64)
+        self.prime = np.array(evaluator.PRIME, dtype=np.int64)
+        self.bit = np.array(evaluator.BIT, dtype=np.int64)
+        if self.omaha:
+            # Splitting each 5 card combo into its 2 hole vals and 3 board vals gives a table small
+            # enough to index directly, which is much faster than searching by prime product.
+            n = len(evaluator.VALS)
+            pairs = list(combinations_with_replacement(range(n), 2))
+            triples = list(combinations_with_replacement(range(n), 3))
+            self.pair_index = np.zeros(n ** 2, dtype=np.int64)
+            for i, (a, b) in enumerate(pairs):
+                self.pair_index[[a*n + b, b*n + a]] = i * len(triples)
+            self.triple_index = np.zeros(n ** 3, dtype=np.int64)
+            for i, triple in enumerate(triples):
+                for a, b, c in permutations(triple):
+                    self.triple_index[(a*n + b)*n + c] = i
+            self.omaha_unsuited = np.array(
+                [unsuited.get(evaluator.PRIME[4*a] * evaluator.PRIME[4*b] * evaluator.PRIME[4*c] *
+                              evaluator.PRIME[4*d] * evaluator.PRIME[4*e], 0)
+                 for a, b in pairs for c, d, e in triples], dtype=np.int64
+            )
+
+    def unsuited(self, prime_products: np.ndarray) -> np.ndarray:
+        return self.unsuited_strengths[np.searchsorted(self.unsuited_keys, prime_products)]
+
+_tables: dict[GameType, _Tables] = {}
+
+def tables(rules: Optional[GameRules] = None) -> _Tables:
+    rules = compare.game_rules(rules)
+    if rules.gametype not in _tables:
+        _tables[rules.gametype] = _Tables(rules)
+    return _tables[rules.gametype]
+
+def _suit_masks(cards: np.ndarray, t: _Tables) -> np.ndarray:
+    """For cards of shape (B, n), returns the (B, 4) rank bitmask of each suit."""
+    bits, suits = t.bit[cards], cards & 3
+    return np.stack([np.where(suits == s, bits, 0).sum(axis=1) for s in range(4)], axis=1)
+
+def evaluate(hands: list[np.ndarray], board: np.ndarray,
+             rules: Optional[GameRules] = None) -> np.ndarray:
+    """`hands` holds one (B, num_hole_cards) array per player, and `board` is a (B, 5) array.
+       Returns the (B, num players) array of each player's best strength, as `Evaluator.best_hand`
+       would give it."""
+    t = tables(rules)
+    strengths = np.empty((len(board), len(hands)), dtype=np.int64)
+    if not t.omaha:
+        board_products = t.prime[board].prod(axis=1)
+        board_masks = _suit_masks(board, t)
+        for i, hole in enumerate(hands):
+            best = t.unsuited(board_products * t.prime[hole].prod(axis=1))
+            flush = t.flush[board_masks | _suit_masks(hole, t)].max(axis=1)
+            strengths[:, i] = np.maximum(best, flush)
+        return strengths
+    n = len(evaluator.VALS)
+    triples = board[:, _BOARD_TRIPLES]
+    triple_vals = triples >> 2
+    triple_indices = t.triple_index[(triple_vals[:, :, 0]*n + triple_vals[:, :, 1])*n + triple_vals[:, :, 2]]
+    triple_masks = t.bit[triples].sum(axis=2)
+    triple_suits = np.where(((triples[:, :, 0] & 3) == (triples[:, :, 1] & 3)) &
+                            ((triples[:, :, 1] & 3) == (triples[:, :, 2] & 3)), triples[:, :, 0] & 3, -1)
+    any_flush_draw = bool((triple_suits >= 0).any())
+    for i, hole in enumerate(hands):
+        pairs = hole[:, _HOLE_PAIRS]
+        pair_indices = t.pair_index[(pairs[:, :, 0] >> 2)*n + (pairs[:, :, 1] >> 2)]
+        best = t.omaha_unsuited[pair_indices[:, :, None] + triple_indices[:, None, :]].max(axis=(1, 2))
+        if any_flush_draw:
+            pair_suits = np.where((pairs[:, :, 0] & 3) == (pairs[:, :, 1] & 3), pairs[:, :, 0] & 3, -2)
+            masks = t.bit[pairs].sum(axis=2)[:, :, None] | triple_masks[:, None, :]
+            # Only combos of five suited cards (and so five distinct vals) have valid masks:
+            masks = np.where(pair_suits[:, :, None] == triple_suits[:, None, :], masks, 0)
+            best = np.maximum(best, t.flush[masks].max(axis=(1, 2)))
+        strengths[:, i] = best
+    return strengths
+
+
+def run_sims(hand_type: HandType, min_opps: int, max_opps: int,
+             block_size: int = 10000, seed: Optional[int] = None, precision: Optional[float] = None,
+             max_trials: Optional[int] = None, initial_evs: Optional[dict[int, EV]] = None,
+             on_progress: Optional[Callable[[dict[int, EV]], None]] = None,
+             rules: Optional[GameRules] = None, board: Sequence[int] = ()) -> dict[int, EV]:
+    """Gives the same kind of results as `main.run_sims` (including with a known `board`), using one
+       vectorized shuffle per block of trials. With a `precision`, the confidence intervals are
+       checked after each block, and `on_progress` is called after each block."""
+    rules = compare.game_rules(rules)
+    t = tables(rules)
+    rng = np.random.default_rng(seed)
+    evs = initial_evs or {num_opps: EV(hand_type=hand_type) for num_opps in range(min_opps, max_opps+1)}
+    deck_size = 52 - t.lowest_card
+    h = rules.num_hole_cards
+    hero_hands = np.array([hand for hand in hand_type.concrete_hands() if not set(board).intersection(hand)],
+                          dtype=np.int64).reshape(-1, h)
+    assert len(hero_hands), f"The board blocks every hand of {hand_type}"
+    known = np.array(board, dtype=np.int64)
+    num_dealt = 5 - len(board)
+    num_trials = trials_limit(precision, max_trials)
+    hands_played = evs[max_opps].hands_played
+    stats = instrumentation.active()
+    while (num_trials is None or hands_played < num_trials) and not precise_enough(evs, precision):
+        block = block_size if num_trials is None else min(block_size, num_trials - hands_played)
+        if stats:
+            start = perf_counter()
+        hero = hero_hands[rng.integers(len(hero_hands), size=block)]
+        keys = rng.random((block, deck_size))
+        keys[:, known - t.lowest_card] = 2.0
+        keys[np.arange(block)[:, None], hero - t.lowest_card] = 2.0 # sorts the hero's cards last
+        dealt = np.argsort(keys, axis=1)[:, :max_opps * h + num_dealt] + t.lowest_card
+        hands = [hero] + [dealt[:, i*h:(i+1)*h] for i in range(max_opps)]
+        comm = np.hstack([np.broadcast_to(known, (block, len(board))), dealt[:, max_opps*h:]])
+        if stats:
+            dealt_time = perf_counter()
+        strengths = evaluate(hands, comm, rules)
+        if stats:
+            evaluated = perf_counter()
+        # Column k-1 of these is about the first k opps:
+        best_opp = np.maximum.accumulate(strengths[:, 1:], axis=1)
+        num_winners = 1 + np.cumsum(strengths[:, 1:] == strengths[:, :1], axis=1)
+        num_winners = np.where(strengths[:, :1] >= best_opp, num_winners, 0) # 0 for a loss
+        for num_opps, ev in evs.items():
+            counts = np.bincount(num_winners[:, num_opps-1], minlength=num_opps+2)
+            for k in np.flatnonzero(counts):
+                ev.add_result(int(k), int(counts[k]))
+        hands_played += block
+        if stats:
+            stats.record_trials(block, start, dealt_time, evaluated, perf_counter())
+            stats.add_category_counts(np.bincount(strengths[:, 0] >> evaluator.CATEGORY_SHIFT).tolist())
+        if on_progress:
+            on_progress(evs)
+        if hands_played % 50000 == 0 and hands_played != num_trials:
+            print(f"EV: {str(evs[max_opps])} vs {max_opps} opps")
+    return evs
+
+def run_sim(hand_type: HandType, num_opps: int, block_size: int = 10000,
+            seed: Optional[int] = None, precision: Optional[float] = None,
+            max_trials: Optional[int] = None, rules: Optional[GameRules] = None,
+            board: Sequence[int] = ()) -> EV:
+    return run_sims(hand_type, num_opps, num_opps, block_size, seed, precision, max_trials,
+                    rules=rules, board=board)[num_opps]
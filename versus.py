@@ -1,85 +1,293 @@
 from __future__ import annotations
-from itertools import product, combinations
-from time import time
+from dataclasses import dataclass
+from itertools import combinations, permutations
+from time import perf_counter, time
+from typing import Iterator, Sequence
+from contextlib import nullcontext
+import json
+import struct
 import sys
 import os
-import re
 
 import compare
 from compare import GameType
-from main import Card, HOLDEM_VALS, SUITS, EV, HandType4Cards, card_val_key
+from evaluator import encode_cards, decode_card
+import instrumentation
+from main import SUITS, EV
 import Utils
 
-def write_to_file(results: list[tuple[str, bool | None]] | list[str]) -> None:
-    filepath = f'tests/{round(time())}.txt'
+RECORD = struct.Struct('<IBB')
+"""One board's result: the board (5 int-encoded cards, 6 bits each), its weight (the size of its class
+   in `canonical_boards`), and the result code for the first hand (see `RESULTS`)."""
+RESULTS: tuple[bool | None, ...] = (False, True, None)
+MAGIC = b'VRS2'
+_READ_CHUNK = RECORD.size * 65536
+
+def pack_board(board: Sequence[int]) -> int:
+    return sum(card << (6 * i) for i, card in enumerate(board))
+
+def unpack_board(packed: int) -> tuple[int, ...]:
+    return tuple((packed >> (6 * i)) & 63 for i in range(5))
+
+def new_results_path(extension: str) -> str:
+    """Returns an unused path in the `tests` folder, named after the current time."""
+    filepath, suffix = f'tests/{round(time())}.{extension}', 1
+    while os.path.exists(filepath):
+        filepath, suffix = f'tests/{round(time())}-{suffix}.{extension}', suffix + 1
     os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, 'w') as f:
-        for result in results:
-            f.write(f"{result[0]}: first hand got a result of {result[1]}\n"
-                    if isinstance(result, tuple) else f"{result}\n")
+    return filepath
 
-def sort_key(combo: tuple[Card, Card, Card, Card, Card]) -> tuple[int, ...]:
-    return tuple(card_val_key(c) for c in combo if c.val in HOLDEM_VALS)
+@dataclass(frozen=True)
+class ResultsHeader:
+    """What a results file's boards were gone through for: the two hands, the excluded cards and the
+       known board (e.g. a flop), as card strings."""
+    hands_str: str
+    exclude_str: str = ''
+    board_str: str = ''
 
-def generate_stats(lines: list[str]) -> None:
-    ev = EV()
-    wins, ties, losses = 0,0,0
-    for line in lines:
-        ev.update(0.5 if line.endswith("None") else int(line.endswith("True")))
-        if line.endswith("None"):
-            ties += 1
-        elif line.endswith("True"):
-            wins += 1
-        else:
-            losses += 1
+    def symmetries(self) -> list[tuple[int, ...]]:
+        """The `suit_symmetries` that the boards were grouped into classes by."""
+        return suit_symmetries(encode_cards(''.join(self.hands_str.split()) + self.exclude_str + self.board_str))
+
+class ResultsWriter:
+    """Streams results to a binary file as they're computed: `MAGIC`, the length-prefixed JSON of the
+       `ResultsHeader`, and then one `RECORD` per board."""
+    def __init__(self, filepath: str, header: ResultsHeader):
+        self.filepath = filepath
+        self._file = open(filepath, 'wb')
+        header_bytes = json.dumps({'hands': header.hands_str, 'exclude': header.exclude_str,
+                                   'board': header.board_str}).encode()
+        self._file.write(MAGIC + struct.pack('<H', len(header_bytes)) + header_bytes)
+
+    def write(self, board: Sequence[int], weight: int, result: bool | None) -> None:
+        self._file.write(RECORD.pack(pack_board(board), weight, RESULTS.index(result)))
+
+    def write_packed(self, packed_board: int, weight: int, result_code: int) -> None:
+        self._file.write(RECORD.pack(packed_board, weight, result_code))
+
+    def __enter__(self) -> ResultsWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._file.close()
+
+def is_results_file(filepath: str) -> bool:
+    with open(filepath, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def read_results(filepath: str) -> tuple[ResultsHeader, Iterator[tuple[int, int, int]]]:
+    """Returns the header of a file made by `ResultsWriter`, and an iterator over its (packed board,
+       weight, result code) records. The records are read in chunks, so the file is never fully in
+       memory."""
+    f = open(filepath, 'rb')
+    assert f.read(len(MAGIC)) == MAGIC, f"{filepath} isn't a binary results file"
+    fields = json.loads(f.read(struct.unpack('<H', f.read(2))[0]))
+    header = ResultsHeader(fields['hands'], fields['exclude'], fields['board'])
+    def records() -> Iterator[tuple[int, int, int]]:
+        with f:
+            while chunk := f.read(_READ_CHUNK):
+                yield from RECORD.iter_unpack(chunk)
+    return header, records()
+
+def result_line(hands_str: str, board_str: str, weight: int, result: bool | None) -> str:
+    return f"{hands_str} {board_str} x{weight}: first hand got a result of {result}"
+
+def export_to_text(filepath: str) -> str:
+    """Writes the text version of a binary results file to a new file, and returns its path."""
+    header, records = read_results(filepath)
+    text_path = new_results_path('txt')
+    with open(text_path, 'w') as f:
+        for packed_board, weight, result_code in records:
+            board_str = ''.join(decode_card(card) for card in unpack_board(packed_board))
+            f.write(result_line(header.hands_str, board_str, weight, RESULTS[result_code]) + '\n')
+    return text_path
+
+def suit_symmetries(fixed_cards: Sequence[int]) -> list[tuple[int, ...]]:
+    """Returns every permutation of the suits that maps the set of `fixed_cards` onto itself, as a
+       tuple giving the image of each of the 52 int-encoded cards. The identity is always included."""
+    symmetries = []
+    for suit_perm in permutations(range(len(SUITS))):
+        card_map = tuple((card & ~3) | suit_perm[card & 3] for card in range(52))
+        if {card_map[card] for card in fixed_cards} == set(fixed_cards):
+            symmetries.append(card_map)
+    return symmetries
+
+def canonical_boards(rem_cards: Sequence[int], symmetries: list[tuple[int, ...]],
+                     num_cards: int = 5) -> Iterator[tuple[tuple[int, ...], int]]:
+    """Yields one board from each class of `num_cards` card boards (from `rem_cards`) that the
+       `symmetries` map onto each other, along with the size of the class. The boards (and
+       `rem_cards`) are in descending order, and each yielded board is the greatest of its class.
+       (With some of the board known, these are the runouts.)"""
+    for board in combinations(rem_cards, num_cards):
+        if len(symmetries) == 1:
+            yield board, 1
+            continue
+        images = {tuple(sorted((card_map[card] for card in board), reverse=True))
+                  for card_map in symmetries}
+        if board == max(images):
+            yield board, len(images)
+
+def num_winners(result: bool | None) -> int:
+    """The number of winners including the first hand, for `EV.add_result` (0 if it lost)."""
+    return 2 if result is None else int(result)
+
+def print_stats(ev: EV) -> None:
     print(f"First hand has an ev of {ev.ev()}")
-    print(f"First hand won {wins / len(lines) * 100}%")
-    print(f"First hand tied {ties / len(lines) * 100}%")
-    print(f"First hand lost {losses / len(lines) * 100}%\n")
+    print(f"First hand won {ev.wins / ev.hands_played * 100}%")
+    print(f"First hand tied {ev.splits.get(2, 0) / ev.hands_played * 100}%")
+    print(f"First hand lost {ev.losses / ev.hands_played * 100}%\n")
+
+def parse_line(line: str) -> tuple[str, int, bool | None]:
+    """Returns the board string, weight and result of a text results line (lines from before weights
+       were written have a weight of 1)."""
+    words = line.split()
+    weight = int(words[3][1:-1]) if words[3].startswith('x') and words[3].endswith(':') else 1
+    return words[2].rstrip(':'), weight, None if line.endswith("None") else line.endswith("True")
+
+def keep_board(board_str: str, result: bool | None, filters: list[str]) -> bool:
+    """Each filter is either a substring of the boards to drop, a result ('True', 'False' or 'None')
+       to drop, or 'flush' to drop boards with 3+ cards of one suit."""
+    return (all(x not in board_str and x != str(result) for x in filters) and
+            ('flush' not in filters or all(board_str.count(suit) < 3 for suit in SUITS)))
+
+def is_suit_specific(filters: list[str]) -> bool:
+    """Whether `filters` can tell apart boards that only differ by a permutation of the suits."""
+    return any(x not in ('flush', 'True', 'False', 'None') and any(suit in x for suit in SUITS)
+               for x in filters)
+
+def board_class(board: Sequence[int], num_known: int, symmetries: list[tuple[int, ...]]) -> list[tuple[int, ...]]:
+    """Every board in the class that `board` (its `num_known` known cards, then the runout) stands for
+       in `canonical_boards`, with the runouts in descending order."""
+    known, runout = tuple(board[:num_known]), board[num_known:]
+    return sorted({known + tuple(sorted((card_map[card] for card in runout), reverse=True))
+                   for card_map in symmetries}, reverse=True)
+
+def trim(filepath: str, filters: list[str], write: bool) -> tuple[EV, EV]:
+    """Streams through the results in `filepath`, printing the stats before and after dropping the
+       boards that match `filters` (and returning them), and (if `write`) writing the kept boards to
+       a new file in the same format.
+
+       Each result's board stands for its whole class of suit-symmetric boards (see
+       `canonical_boards`), which filtering on vals, results or 'flush' treats alike. A filter on a
+       specific suit (e.g. 'Tc') is applied to every board of the class separately, which needs the
+       symmetries from the header of a binary file (the kept boards of a partly kept class are written
+       with a weight of 1 each)."""
+    suit_specific = is_suit_specific(filters)
+    before, after = EV(), EV()
+    if is_results_file(filepath):
+        header, records = read_results(filepath)
+        symmetries = header.symmetries()
+        num_known = len(header.board_str) // 2
+        with (ResultsWriter(new_results_path('bin'), header) if write else nullcontext()) as writer:
+            for packed_board, weight, result_code in records:
+                result = RESULTS[result_code]
+                before.add_result(num_winners(result), weight)
+                board = unpack_board(packed_board)
+                if not suit_specific or weight == 1:
+                    if keep_board(''.join(decode_card(card) for card in board), result, filters):
+                        after.add_result(num_winners(result), weight)
+                        if writer:
+                            writer.write_packed(packed_board, weight, result_code)
+                    continue
+                boards = board_class(board, num_known, symmetries)
+                assert len(boards) == weight
+                kept = [board for board in boards
+                        if keep_board(''.join(decode_card(card) for card in board), result, filters)]
+                if kept:
+                    after.add_result(num_winners(result), len(kept))
+                if writer and len(kept) == weight:
+                    writer.write_packed(packed_board, weight, result_code)
+                elif writer:
+                    for board in kept:
+                        writer.write(board, 1, result)
+    else:
+        if suit_specific:
+            with open(filepath, 'r') as f:
+                if any(parse_line(line.rstrip('\n'))[1] > 1 for line in f):
+                    raise ValueError(f"Text results don't hold the excluded cards, so their boards can't "
+                                     f"be filtered by suit: trim the binary results file instead")
+        with open(filepath, 'r') as f, (open(new_results_path('txt'), 'w') if write else nullcontext()) as out:
+            for line in f:
+                board_str, weight, result = parse_line(line.rstrip('\n'))
+                before.add_result(num_winners(result), weight)
+                if keep_board(board_str, result, filters):
+                    after.add_result(num_winners(result), weight)
+                    if out:
+                        out.write(line)
+    print("Before trimming: ", end='')
+    print_stats(before)
+    print("After trimming: ", end='')
+    print_stats(after)
+    return before, after
 
 def main() -> None: # todo - mypy says wrong line when type for main is removed
     Utils.pypy_notice()
     if sys.argv[1] == 'trim':
-        filepath = sys.argv[2]
-        with open(filepath, 'r') as f:
-            lines = f.read().splitlines()
-        print("Before trimming: ", end='')
-        generate_stats(lines)
-        trimmed_lines = []
-        for line in lines:
-            comm = line.split()[2]
-            if (all(x not in comm and (x not in ('True', 'False', 'None') or not line.endswith(x))
-                    for x in sys.argv[3:]) and
-                ('flush' not in sys.argv[3:] or all(comm.count(suit) < 3 for suit in SUITS))):
-                trimmed_lines.append(line)
-        print("After trimming: ", end='')
-        generate_stats(trimmed_lines)
-        if 'nowrite' not in sys.argv[3:]:
-            write_to_file(trimmed_lines)
+        trim(sys.argv[2], [x for x in sys.argv[3:] if x != 'nowrite'], 'nowrite' not in sys.argv[3:])
+        sys.exit(0)
+    if sys.argv[1] == 'export':
+        print(f"Wrote {export_to_text(sys.argv[2])}")
         sys.exit(0)
     hand_1_str, hand_2_str = sys.argv[1:3]
-    exclude_str = sys.argv[3] if len(sys.argv) > 3 else ''
+    exclude_str = sys.argv[3] if len(sys.argv) > 3 and not sys.argv[3].startswith('--') else ''
     compare.set_gametype(GameType.OMAHA)
-    cards_in_play = [Card(s[i], s[i+1]) for s in (hand_1_str, hand_2_str, exclude_str)
-                                        for i in range(0, len(s), 2)]
-    REM_CARDS = [c for c in (Card(*x) for x in product(HOLDEM_VALS[::-1], SUITS)) if c not in cards_in_play]
-    assert len(REM_CARDS) == 52 - sum(len(x) / 2 for x in (hand_1_str, hand_2_str, exclude_str))
-    comm_combos = sorted(combinations(REM_CARDS, 5), key=sort_key)
-    print(f"Going through {len(comm_combos)} community combos...")
-    results: list[tuple[str, bool | None]] = []
-    ev_hand1 = EV()
+    hands = [encode_cards(hand_1_str), encode_cards(hand_2_str)]
+    # A known flop or turn is fixed, and only the runouts after it are gone through:
+    board_str = Utils.flag_value('--board', '')
+    known_board = tuple(encode_cards(board_str))
+    cards_in_play = hands[0] + hands[1] + encode_cards(exclude_str) + list(known_board)
+    rem_cards = [c for c in range(51, -1, -1) if c not in cards_in_play]
+    assert len(rem_cards) == 52 - sum(len(x) / 2 for x in (hand_1_str, hand_2_str, exclude_str, board_str))
+    assert len(known_board) <= 5
+    # Suit permutations that leave both hands, the excluded cards and the known board unchanged also
+    # leave the result of each board unchanged, so only one board per class needs to be evaluated.
+    symmetries = suit_symmetries(cards_in_play)
+    print(f"Going through community combos, with {len(symmetries)} suit symmetries...")
+    ev = EV()
     print_interval = 10000
-    for i, comm_cards in enumerate(comm_combos):
-        if i % print_interval == 0 and i > 0:
-            for result in results[i-print_interval:i]:
-                print(result)
-            print(f"{i} comm hands processed; current EV for hand 1 is {ev_hand1.ev()}%\n\n\n\n")
-        comm_str = ''.join(str(x) for x in comm_cards)
-        cards_str = f"{hand_1_str} {hand_2_str} {comm_str}"
-        results.append((cards_str, compare.is_first_hand_better(cards_str)))
-        ev_hand1.update(0.5 if results[-1][1] is None else int(results[-1][1])) # assumes only 1 opp
-    print(f"{i} comm hands processed; current EV for hand 1 is {ev_hand1.ev()}%\n\n\n\n")
-    write_to_file(results)
+    recent_lines: list[str] = []
+    hands_str = f"{hand_1_str} {hand_2_str}"
+    ev_ = compare.evaluator()
+    partial_board = ev_.prepare_partial_board(known_board)
+    stats = instrumentation.enable() if '--stats' in sys.argv else None
+    last_board_done = perf_counter() # with stats, the time between boards is the time to deal them
+    with ResultsWriter(new_results_path('bin'), ResultsHeader(hands_str, exclude_str, board_str)) as writer:
+        for i, (runout, weight) in enumerate(canonical_boards(rem_cards, symmetries, 5 - len(known_board))):
+            if i % print_interval == 0 and i > 0:
+                print('\n'.join(recent_lines))
+                recent_lines.clear()
+                print(f"{i} comm hands processed; current EV for hand 1 is {ev.ev()}%\n\n\n\n")
+                if stats:
+                    stats.log_progress()
+            if stats:
+                dealt = perf_counter()
+            comm_cards = known_board + runout
+            board_info = ev_.complete_board(partial_board, runout)
+            strengths = [ev_.best_hand(hand, board_info) for hand in hands]
+            if stats:
+                evaluated = perf_counter()
+            best = max(strengths)
+            winners = [player for player, strength in enumerate(strengths) if strength == best]
+            result = None if len(winners) == 2 else winners == [0] # assumes only 1 opp
+            if stats:
+                compared = perf_counter()
+            writer.write(comm_cards, weight, result)
+            if stats:
+                stats.record_trials(1, last_board_done, dealt, evaluated, compared)
+                stats.count_strengths(strengths)
+                last_board_done = perf_counter()
+                stats.add_time('io', last_board_done - compared)
+            ev.add_result(num_winners(result), weight)
+            recent_lines.append(result_line(hands_str, ''.join(decode_card(x) for x in comm_cards),
+                                            weight, result))
+    print(f"{ev.hands_played} comm hands processed (evaluating {i+1}); "
+          f"EV for hand 1 is {ev.ev()}%\n\n\n\n")
+    print(f"Wrote the results to {writer.filepath} (run `versus.py export` on it for a text version)")
+    if stats:
+        report_path = Utils.flag_value('--stats')
+        assert report_path is not None
+        Utils.write_atomically(report_path, json.dumps(stats.report(), indent=2))
+        print(f"Wrote the stats to {report_path}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file